@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Scaling of FIFO matching in proceed_trades on synthetic trade histories.
+# Each symbol first accumulates many small buys and then sells them off one by one,
+# which is the worst case for a list-based queue (pop(0) on a long list).
+#
+#   python benchmarks/bench_lots.py --trades 100000
+
+import os
+import sys
+import argparse
+import contextlib
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ibtax.lots import proceed_trades  # noqa: E402
+
+
+def synthetic_trades(count, symbols=10, seed=0):
+    rnd = np.random.default_rng(seed)
+    per_symbol = count // symbols
+    buys = per_symbol // 2
+    frames = []
+    for n in range(symbols):
+        quantity = rnd.integers(1, 100, buys)
+        price = rnd.uniform(10, 300, per_symbol).round(2)
+        quantity = np.concatenate([quantity, -quantity])
+        frames.append(pd.DataFrame({
+            "symbol": f"S{n}",
+            "date": pd.date_range("2020-01-01", periods=per_symbol, freq="min"),
+            "price": price,
+            "fee": -1.0,
+            "quantity": quantity,
+            "currency": "USD",
+            "proceeds": (-quantity * price).round(2),
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def bench(count):
+    trades = {2020: synthetic_trades(count)}
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(None):
+        rows = proceed_trades([(2020, None)], trades)
+    elapsed = time.perf_counter() - start
+    return elapsed, len(rows[2020])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, default=100000, help="max number of trades")
+    args = parser.parse_args()
+
+    count = args.trades // 8
+    print(f"{'trades':>10} {'rows':>10} {'seconds':>10} {'us/trade':>10}")
+    while count <= args.trades:
+        elapsed, rows = bench(count)
+        print(f"{count:>10} {rows:>10} {elapsed:>10.3f} {elapsed / count * 1e6:>10.2f}")
+        count *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Download time of CBR rate tables for many currencies from the local stand-in server
+# (cbr_server.py), one request at a time and in parallel.
+#
+#   python benchmarks/bench_rates.py --latency 0.3 --fail 1
+
+import os
+import sys
+import argparse
+import tempfile
+import contextlib
+import io
+import time
+from datetime import datetime
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, ".."))
+sys.path.insert(0, benchDir)
+from ibtax import rates  # noqa: E402
+import cbr_server  # noqa: E402
+
+
+def download(server, names, jobs, start_date):
+    with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        tables = rates.get_crs_tables(
+            start_date, datetime(2021, 12, 31), os.path.join(folder, "rates.db"), server.url, names, jobs
+        )
+        return time.perf_counter() - start, tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel download of CBR rate tables from the local stand-in server")
+    parser.add_argument("--latency", type=float, default=0.3, help="server delay per response, seconds")
+    parser.add_argument("--fail", type=int, default=0, help="503 answers before the first good one, per currency")
+    parser.add_argument("--start-date", default="01.01.2015")
+    args = parser.parse_args()
+    # retries in the benchmark wait as little as possible
+    rates.downloadBackoff = 0.01
+    names = list(cbr_server.cbrCurrencies)
+    # the server's own work is done before timing, only latency is left
+    for name in names:
+        cbr_server.rates_xlsx(name, datetime.strptime(args.start_date, "%d.%m.%Y"), datetime(2021, 12, 31))
+    print(f"{len(names)} currencies, latency {args.latency} s, {args.fail} failures per currency")
+    results = {}
+    for jobs in (1, rates.downloadJobs):
+        server = cbr_server.serve(latency=args.latency, fail=args.fail)
+        try:
+            seconds, tables = download(server, names, jobs, args.start_date)
+        finally:
+            server.shutdown()
+        results[jobs] = tables
+        print(f"jobs {jobs:>2}: {seconds:6.2f} s, {sum(server.requests.values())} requests")
+    first, last = results.values()
+    assert all(first.index[name][1].tolist() == last.index[name][1].tolist() for name in names), "tables differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Local stand-in for the cbr.ru endpoints used by ibtax.rates: the DownloadExcel rate export
+# and the XML_valFull.asp currency directory, with synthetic rates from generate.py.
+#
+#   python benchmarks/cbr_server.py --port 8765 --latency 0.2 --fail 1
+#   python ib.py --rates-source http://127.0.0.1:8765 --rates-db /tmp/rates.db
+#
+# --latency delays every response, --fail answers 503 to the first N requests for each currency,
+# so parallel downloads and retries can be tested and timed without network.
+
+import io
+import os
+import sys
+import time
+import argparse
+import threading
+from functools import lru_cache
+from datetime import datetime
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generate  # noqa: E402
+
+# ISO code -> (CBR code, nominal)
+cbrCurrencies = {
+    "USD": ("R01235", 1),
+    "EUR": ("R01239", 1),
+    "GBP": ("R01035", 1),
+    "CHF": ("R01775", 1),
+    "CNY": ("R01375", 1),
+    "HKD": ("R01200", 10),
+    "JPY": ("R01820", 100),
+    "CAD": ("R01350", 1),
+    "AUD": ("R01010", 1),
+    "SEK": ("R01770", 10),
+    "NOK": ("R01535", 10),
+    "DKK": ("R01215", 10),
+}
+codeCurrencies = {code: currency for currency, (code, _) in cbrCurrencies.items()}
+excelType = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def directory_xml():
+    items = "".join(
+        f'<Item ID="{code}"><Name>{generate.currencyNames.get(currency, currency)}</Name><EngName>{currency}</EngName>'
+        f'<Nominal>{nominal}</Nominal><ParentCode>{code}    </ParentCode><ISO_Char_Code>{currency}</ISO_Char_Code></Item>'
+        for currency, (code, nominal) in cbrCurrencies.items()
+    )
+    return f'<?xml version="1.0" encoding="utf-8"?><Valuta name="Foreign Currency Market Lib">{items}</Valuta>'.encode()
+
+
+@lru_cache(maxsize=None)
+def rates_xlsx(currency, start, end):
+    df = generate.generate_rates(currency, start, end)
+    df["nominal"] = cbrCurrencies[currency][1]
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        time.sleep(self.server.latency)
+        if url.path == "/scripts/XML_valFull.asp":
+            return self.reply(200, directory_xml(), "application/xml")
+        if not url.path.startswith("/Queries/UniDbQuery/DownloadExcel/"):
+            return self.reply(404, b"not found")
+        currency = codeCurrencies.get(query.get("VAL_NM_RQ", [""])[0])
+        if currency is None:
+            return self.reply(404, b"unknown currency")
+        with self.server.lock:
+            self.server.requests[currency] += 1
+            attempt = self.server.requests[currency]
+        if attempt <= self.server.fail:
+            return self.reply(503, b"try again later")
+        start = datetime.strptime(query["From"][0], "%d.%m.%Y")
+        end = datetime.strptime(query["To"][0], "%d.%m.%Y")
+        self.reply(200, rates_xlsx(currency, start, end), excelType)
+
+    def reply(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up waiting
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port=0, latency=0.0, fail=0):
+    """Server running in a background thread; server.url is the rates source, server.requests counts requests per currency"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail = fail
+    server.lock = threading.Lock()
+    server.requests = Counter()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the cbr.ru rate export")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--fail", type=int, default=0, help="answer 503 to the first N requests for each currency")
+    args = parser.parse_args()
+    server = serve(args.port, args.latency, args.fail)
+    print(f"Serving {', '.join(cbrCurrencies)} at {server.url}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Synthetic Interactive Brokers activity statements and CBR rate tables.
+#
+#   python benchmarks/generate.py /tmp/ib-bench --years 2019-2021 --trades 20000
+#
+# writes /tmp/ib-bench/reports/{year}.csv and /tmp/ib-bench/rates/{currency}.xlsx,
+# the latter in the layout of the cbr.ru DownloadExcel export (nominal, data, curs, cdx).
+
+import os
+import zlib
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+currencyNames = {
+    "USD": "Доллар США",
+    "EUR": "Евро",
+}
+
+
+def parse_years(value):
+    if "-" in value:
+        first, last = value.split("-")
+        return list(range(int(first), int(last) + 1))
+    return [int(year) for year in value.split(",")]
+
+
+def number(value):
+    # IB writes thousands separators, so big quantities end up quoted
+    text = f"{value:,}" if isinstance(value, (int, np.integer)) else f"{value:,.2f}"
+    return f'"{text}"' if "," in text else text
+
+
+def isin(symbol):
+    return f"US{zlib.crc32(symbol.encode()) % 10 ** 10:010d}"
+
+
+def random_dates(rng, year, count, with_time=False):
+    start = pd.Timestamp(year, 1, 1)
+    seconds = np.sort(rng.integers(0, 365 * 24 * 3600, count))
+    dates = start + pd.to_timedelta(seconds, unit="s")
+    if not with_time:
+        return [date.strftime("%Y-%m-%d") for date in dates]
+    return [date.strftime("%Y-%m-%d, %H:%M:%S") for date in dates]
+
+
+def currency_blocks(rows, total):
+    """Rows (currency, line, amount) grouped by currency, each group closed by its Total line like in IB statements"""
+    lines = []
+    for currency in sorted({currency for currency, _, _ in rows}):
+        block = [(line, amount) for cur, line, amount in rows if cur == currency]
+        lines.extend(line for line, _ in block)
+        lines.append(total.format(amount=number(round(sum(amount for _, amount in block), 2))))
+    return lines
+
+
+def trades_lines(rng, year, args, symbols, options, positions):
+    lines = [
+        "Trades,Header,DataDiscriminator,Asset Category,Currency,Symbol,Date/Time,Quantity,T. Price,C. Price,Proceeds,"
+        "Comm/Fee,Basis,Realized P/L,MTM P/L,Code"
+    ]
+    instruments = symbols + options
+    picks = rng.integers(0, len(instruments), args.trades)
+    totals = {}
+    for date, pick in zip(random_dates(rng, year, args.trades, with_time=True), picks):
+        symbol = instruments[pick]
+        option = symbol in options
+        position = positions.get(symbol, 0)
+        if position > 0 and rng.random() < 0.45:
+            quantity = -int(rng.integers(1, position + 1))
+        else:
+            quantity = int(rng.integers(1, 10 if option else 2000))
+        positions[symbol] = position + quantity
+        price = round(float(rng.uniform(0.5, 20) if option else rng.uniform(5, 500)), 2)
+        proceeds = round(-quantity * price * (100 if option else 1), 2)
+        fee = -round(float(rng.uniform(0.35, 5)), 2)
+        category = "Equity and Index Options" if option else "Stocks"
+        total = totals.setdefault(category, [0.0, 0.0])
+        total[0] += proceeds
+        total[1] += fee
+        lines.append(
+            f'Trades,Data,Order,{category},USD,{symbol},"{date}",{number(quantity)},{price},{price},{number(proceeds)},'
+            f'{fee},{number(-proceeds)},0,0,{"O" if quantity > 0 else "C"}'
+        )
+        if quantity < 0:
+            # a closing order is followed by the lot it closes, with empty proceeds and commission as in IB statements
+            lines.append(
+                f'Trades,Data,ClosedLot,{category},USD,{symbol},{date[:10]},{number(-quantity)},{price},,,,'
+                f'{number(proceeds)},0,,'
+            )
+    for category, (proceeds, fee) in totals.items():
+        lines.append(f"Trades,Total,,{category},USD,,,,,,{number(round(proceeds, 2))},{number(round(fee, 2))},0,0,0,")
+    # forex conversions come under their own header with a different commission column
+    lines.append(
+        "Trades,Header,DataDiscriminator,Asset Category,Currency,Symbol,Date/Time,Quantity,T. Price,,Proceeds,"
+        "Comm in USD,,,,Code"
+    )
+    for date in random_dates(rng, year, 4, with_time=True):
+        lines.append(f'Trades,Data,Order,Forex,USD,EUR.USD,"{date}",1000,1.1,,-1100,-2,,,,')
+    return lines
+
+
+def statement_lines(rng, year, args, symbols, options, positions):
+    lines = [
+        "Statement,Header,Field Name,Field Value",
+        "Statement,Data,BrokerName,Interactive Brokers",
+        f"Statement,Data,Period,\"January 1, {year} - December 31, {year}\"",
+    ]
+
+    lines.append("Deposits & Withdrawals,Header,Currency,Settle Date,Description,Amount")
+    rows = []
+    for date in random_dates(rng, year, args.deposits):
+        currency = str(rng.choice(["USD", "EUR", "RUB"]))
+        amount = int(rng.integers(100, 10000)) * (1 if rng.random() < 0.8 else -1)
+        rows.append((currency, f"Deposits & Withdrawals,Data,{currency},{date},Electronic Fund Transfer,{number(amount)}", amount))
+    lines.extend(currency_blocks(rows, "Deposits & Withdrawals,Data,Total,,,{amount}"))
+
+    lines.extend(trades_lines(rng, year, args, symbols, options, positions))
+
+    lines.append("Fees,Header,Subtitle,Currency,Date,Description,Amount")
+    rows = []
+    for date in random_dates(rng, year, args.fees):
+        amount = -round(float(rng.uniform(1, 15)), 2)
+        rows.append(("USD", f"Fees,Data,Other Fees,USD,{date},Market data subscription,{amount}", amount))
+    lines.extend(currency_blocks(rows, "Fees,Data,Total,,,,{amount}"))
+
+    dividends = []
+    for date in random_dates(rng, year, args.dividends):
+        symbol = symbols[int(rng.integers(0, len(symbols)))]
+        dividends.append((date, symbol, round(float(rng.uniform(1, 500)), 2)))
+    lines.append("Dividends,Header,Currency,Date,Description,Amount")
+    rows = [
+        ("USD", f"Dividends,Data,USD,{date},{symbol}({isin(symbol)}) Cash Dividend USD 0.25 per Share "
+                f"(Ordinary Dividend),{number(amount)}", amount)
+        for date, symbol, amount in dividends
+    ]
+    lines.extend(currency_blocks(rows, "Dividends,Data,Total,,,{amount}"))
+
+    lines.append("Withholding Tax,Header,Currency,Date,Description,Amount,Code")
+    withholding = args.withholding if args.withholding is not None else len(dividends)
+    rows = []
+    for n in range(withholding):
+        date, symbol, amount = dividends[n % len(dividends)] if dividends else (f"{year}-06-01", symbols[0], 10)
+        tax = -round(amount * 0.1, 2)
+        rows.append(("USD", f"Withholding Tax,Data,USD,{date},{symbol}({isin(symbol)}) Cash Dividend USD 0.25 per Share "
+                            f"- US Tax,{tax},", tax))
+    lines.extend(currency_blocks(rows, "Withholding Tax,Data,Total,,,{amount},"))
+
+    lines.append(
+        "Change in Dividend Accruals,Header,Asset Category,Currency,Symbol,Date,Ex Date,Pay Date,Quantity,Tax,Fee,"
+        "Gross Rate,Gross Amount,Net Amount,Code"
+    )
+    for date in random_dates(rng, year, args.accruals):
+        symbol = symbols[int(rng.integers(0, len(symbols)))]
+        quantity = int(rng.integers(1, 500))
+        gross = round(quantity * 0.25, 2)
+        code = "Po" if rng.random() < 0.5 else "Re"
+        sign = 1 if code == "Po" else -1
+        lines.append(
+            f"Change in Dividend Accruals,Data,Stocks,USD,{symbol},{date},{date},{date},{quantity},"
+            f"{sign * round(gross * 0.1, 2)},0,0.25,{sign * gross},{sign * round(gross * 0.9, 2)},{code}"
+        )
+
+    lines.append("Interest,Header,Currency,Date,Description,Amount")
+    rows = []
+    for date in random_dates(rng, year, args.interest):
+        currency = str(rng.choice(["USD", "EUR"]))
+        amount = round(float(rng.uniform(-2, 20)), 2)
+        rows.append((currency, f"Interest,Data,{currency},{date},{currency} Credit Interest,{amount}", amount))
+    lines.extend(currency_blocks(rows, "Interest,Data,Total,,,{amount}"))
+    return lines
+
+
+def generate_statements(outdir, args):
+    rng = np.random.default_rng(args.seed)
+    symbols = [f"SYM{n}" for n in range(args.symbols)]
+    options = [f"SYM{n % args.symbols} {20 + n % 10}0117C00{100 + n}000" for n in range(args.options)]
+    positions = {}
+    reports = os.path.join(outdir, "reports")
+    os.makedirs(reports, exist_ok=True)
+    fnames = []
+    for year in args.years:
+        fname = os.path.join(reports, f"{year}.csv")
+        with open(fname, "w", encoding="utf8") as file:
+            file.write("\n".join(statement_lines(rng, year, args, symbols, options, positions)) + "\n")
+        fnames.append(fname)
+    return fnames
+
+
+def generate_rates(currency, start, end, seed=0):
+    rng = np.random.default_rng([seed, sum(map(ord, currency))])
+    dates = pd.bdate_range(start, end)
+    base = {"USD": 70.0, "EUR": 80.0}.get(currency, 50.0)
+    values = (base + np.cumsum(rng.normal(0, 0.3, len(dates)))).round(4)
+    return pd.DataFrame({
+        "nominal": 1,
+        "data": dates,
+        "curs": values,
+        "cdx": currencyNames.get(currency, currency),
+    })
+
+
+def write_rates(outdir, start, end, currencies=("USD", "EUR"), seed=0):
+    folder = os.path.join(outdir, "rates")
+    os.makedirs(folder, exist_ok=True)
+    for currency in currencies:
+        generate_rates(currency, start, end, seed).to_excel(os.path.join(folder, f"{currency}.xlsx"), index=False)
+    return folder
+
+
+def add_arguments(parser):
+    parser.add_argument("--years", type=parse_years, default=parse_years("2019-2021"), help="e.g. 2019-2021 or 2019,2021")
+    parser.add_argument("--trades", type=int, default=2000, help="trades per year")
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--options", type=int, default=5, help="option contracts traded")
+    parser.add_argument("--dividends", type=int, default=100, help="dividends per year")
+    parser.add_argument("--withholding", type=int, default=None, help="withholding rows per year (default: one per dividend)")
+    parser.add_argument("--accruals", type=int, default=20, help="dividend accrual changes per year")
+    parser.add_argument("--fees", type=int, default=12, help="fees per year")
+    parser.add_argument("--interest", type=int, default=12, help="interest rows per year")
+    parser.add_argument("--deposits", type=int, default=6, help="deposits and withdrawals per year")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic IB statements and CBR rate tables")
+    parser.add_argument("outdir")
+    add_arguments(parser)
+    args = parser.parse_args()
+    for fname in generate_statements(args.outdir, args):
+        print(fname)
+    print(write_rates(args.outdir, datetime(min(args.years) - 1, 12, 1), datetime(max(args.years), 12, 31), seed=args.seed))
+
+
+if __name__ == "__main__":
+    main()
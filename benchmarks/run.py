@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Per-stage timings of the ibtax pipeline on synthetic statements.
+#
+#   python benchmarks/run.py --trades 20000 --years 2015-2022
+#   python benchmarks/run.py --trades 20000 --years 2015-2022 --compare benchmarks/results/abc1234.json
+#
+# Every stage is timed separately; with --memory the run is repeated under tracemalloc to get the
+# peak allocation of each stage. Results go to benchmarks/results/{label}.json (label defaults to
+# the current git commit) together with a digest of every computed table and total and of the
+# rendered documents, so a comparison with the same parameters also shows whether the tax figures
+# stayed byte-identical.
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import hashlib
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+
+benchDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(benchDir, ".."))
+sys.path.insert(0, benchDir)
+from ibtax.rates import get_crs_tables  # noqa: E402
+from ibtax.statement import split_report, load_data  # noqa: E402
+from ibtax.lots import proceed_trades  # noqa: E402
+from ibtax.calc import year_results, trades_calc  # noqa: E402
+from ibtax.doc import create_doc  # noqa: E402
+import generate  # noqa: E402
+
+stages = ["rates", "split_report", "load_data", "fx_lookup", "year_results", "proceed_trades", "trades_calc", "create_doc"]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=benchDir, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "local"
+
+
+class Stages:
+    def __init__(self, memory):
+        self.memory = memory
+        self.times = {stage: 0.0 for stage in stages}
+        self.peaks = {stage: 0 for stage in stages}
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        if self.memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        yield
+        self.times[stage] += time.perf_counter() - start
+        if self.memory:
+            self.peaks[stage] = max(self.peaks[stage], tracemalloc.get_traced_memory()[1] - base)
+
+
+def figures_digest(results):
+    digests = {}
+    for year, res in sorted(results.items()):
+        digest = hashlib.sha256()
+        for name, value in sorted(res.items()):
+            digest.update(name.encode())
+            if isinstance(value, pd.DataFrame):
+                digest.update(value.to_csv(index=False).encode())
+            else:
+                digest.update(repr(None if value is None else float(value)).encode())
+        digests[year] = digest.hexdigest()
+    return digests
+
+
+def documents_digest(years):
+    digests = {}
+    for year in years:
+        with zipfile.ZipFile(f"Пояснительная записка {year}.docx") as doc:
+            digests[year] = hashlib.sha256(doc.read("word/document.xml")).hexdigest()
+    return digests
+
+
+def run_pipeline(workdir, source, years, measure):
+    dbName = os.path.join(workdir, "rates.db")
+    startDate = f"01.12.{min(years) - 1}"
+    if os.path.exists(dbName):
+        os.remove(dbName)
+
+    with measure("rates"):
+        rates = get_crs_tables(startDate, datetime(max(years), 12, 31), dbName, source)
+
+    yearReports = [(year, os.path.join(workdir, "reports", f"{year}.csv")) for year in years]
+    trades = {}
+    results = {}
+    counts = {"rows": 0, "fx_rows": 0}
+    for report in yearReports:
+        year = report[0]
+        with measure("split_report"):
+            sections = split_report(report)
+        with measure("load_data"):
+            cashflow, trades[year], comissions, div, div_tax, div_accurals, interests = load_data(year, sections)
+        del sections
+        frames = [df for df in (cashflow, trades[year], comissions, div, div_accurals, interests) if df is not None]
+        counts["rows"] += sum(len(df) for df in frames)
+        dates = pd.concat([df.date for df in frames], ignore_index=True)
+        curs = pd.concat([df.currency for df in frames], ignore_index=True)
+        counts["fx_rows"] += len(dates)
+        with measure("fx_lookup"):
+            rates.get_currencies(dates, curs)
+        with measure("year_results"):
+            results[year] = year_results(year, cashflow, comissions, div, div_tax, div_accurals, interests, rates)
+
+    with measure("proceed_trades"):
+        rows = proceed_trades(yearReports, trades)
+    counts["matched_rows"] = int(sum(len(rows[year]) for year in years))
+    with measure("trades_calc"):
+        for year in years:
+            results[year].update(trades_calc(rows[year], rates))
+    with measure("create_doc"):
+        for year in years:
+            create_doc(year, results[year], startDate, outdir=workdir)
+    return results, counts
+
+
+def compare(current, fname):
+    with open(fname, encoding="utf8") as file:
+        previous = json.load(file)
+    print(f"\nСравнение с {previous['label']} ({fname}):")
+    print(f"{'stage':<16} {'before, s':>10} {'after, s':>10} {'ratio':>8}")
+    for stage in stages:
+        before = previous["seconds"].get(stage)
+        after = current["seconds"][stage]
+        ratio = f"{after / before:8.2f}" if before else f"{'-':>8}"
+        print(f"{stage:<16} {before if before is not None else float('nan'):>10.3f} {after:>10.3f} {ratio}")
+    if previous["params"] != current["params"]:
+        print("Параметры генерации отличаются, цифры не сравниваются")
+        return 0
+    changed = [year for year, digest in current["figures"].items() if previous["figures"].get(year) != digest]
+    changed_docs = [year for year, digest in current["documents"].items() if previous["documents"].get(year) != digest]
+    if changed or changed_docs:
+        print(f"ИЗМЕНИЛИСЬ расчеты за {changed} и документы за {changed_docs}")
+        return 1
+    print("Расчеты и документы совпадают")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage of ibtax on synthetic statements")
+    generate.add_arguments(parser)
+    parser.add_argument("--memory", action="store_true", help="repeat the run under tracemalloc for per-stage peaks")
+    parser.add_argument("--label", default=None, help="results name (default: git commit)")
+    parser.add_argument("--results", default=os.path.join(benchDir, "results"), help="results folder")
+    parser.add_argument("--compare", default=None, help="results file of a previous run")
+    parser.add_argument("--keep", action="store_true", help="keep the generated statements and documents")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ib-bench-")
+    cwd = os.getcwd()
+    try:
+        generate.generate_statements(workdir, args)
+        rates = generate.write_rates(workdir, datetime(min(args.years) - 1, 12, 1), datetime(max(args.years), 12, 31), seed=args.seed)
+        os.chdir(workdir)
+
+        timing = Stages(memory=False)
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            results, counts = run_pipeline(workdir, rates, args.years, timing)
+        peaks = None
+        if args.memory:
+            tracing = Stages(memory=True)
+            tracemalloc.start()
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                run_pipeline(workdir, rates, args.years, tracing)
+            tracemalloc.stop()
+            peaks = tracing.peaks
+
+        current = {
+            "label": args.label or git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "params": {name: value for name, value in vars(args).items() if name not in ("memory", "label", "results", "compare", "keep")},
+            "counts": counts,
+            "seconds": timing.times,
+            "peak_bytes": peaks,
+            "figures": {str(year): digest for year, digest in figures_digest(results).items()},
+            "documents": {str(year): digest for year, digest in documents_digest(args.years).items()},
+        }
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Данные сохранены в {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'stage':<16} {'seconds':>10} {'peak, MB':>10}")
+    for stage in stages:
+        peak = f"{peaks[stage] / 2 ** 20:10.1f}" if peaks else f"{'-':>10}"
+        print(f"{stage:<16} {timing.times[stage]:>10.3f} {peak}")
+    print(f"{'total':<16} {sum(timing.times.values()):>10.3f}")
+    print(f"rows: {counts['rows']}, fx lookups: {counts['fx_rows']}, matched rows: {counts['matched_rows']}")
+
+    os.makedirs(args.results, exist_ok=True)
+    fname = os.path.join(args.results, f"{current['label']}.json")
+    with open(fname, "w", encoding="utf8") as file:
+        json.dump(current, file, indent=2, ensure_ascii=False)
+    print(f"Результаты сохранены в {fname}")
+
+    if args.compare:
+        sys.exit(compare(current, args.compare))
+
+
+if __name__ == "__main__":
+    main()
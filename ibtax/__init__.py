@@ -0,0 +1,6 @@
+# coding: utf-8
+
+from .rates import CurrencyRates, get_crs_tables
+from .engine import TaxReportEngine, YearResult
+
+__all__ = ["TaxReportEngine", "YearResult", "CurrencyRates", "get_crs_tables"]
@@ -0,0 +1,119 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import traceback
+import contextlib
+from datetime import datetime
+
+from .rates import get_crs_tables, ratesDbName, ratesSource
+from .statement import preprocess_reports, find_reports, reportDirName, dirname
+from .lots import checkpointDirName
+from .engine import TaxReportEngine, select_years, run_jobs
+from .cache import cacheDirName
+from .instrument import stage
+
+# Суммы по всем годам клиента в итоговой таблице
+incomeFields = ['income_rub_sum_cb', 'income_rub_sum_pfi', 'div_final_sum', 'interest_rub_sum']
+taxFields = ['income_rest_sum_cb', 'income_rest_sum_pfi', 'div_tax_need_pay_final_sum', 'interest_rest_sum']
+
+
+def load_manifest(fname):
+    """Список клиентов из json файла вида
+    [{"name": "ivanov", "start_date": "20.03.2019", "reports": "ivanov/reports", "output": "out/ivanov"}, ...]
+    reports по умолчанию {name}/reports, output - {name}; относительные пути - от папки манифеста
+    """
+    with open(fname, encoding="utf8") as file:
+        clients = json.load(file)
+    base = os.path.dirname(os.path.abspath(fname))
+    names = set()
+    for client in clients:
+        name = client["name"]
+        assert name not in names, f"Клиент {name} указан в манифесте дважды"
+        names.add(name)
+        datetime.strptime(client["start_date"], "%d.%m.%Y")
+        client["reports"] = os.path.join(base, client.get("reports", os.path.join(name, reportDirName)))
+        client["output"] = os.path.join(base, client.get("output", name))
+    outputs = [client["output"] for client in clients]
+    assert len(set(outputs)) == len(outputs), "У клиентов должны быть разные папки output"
+    return clients
+
+
+def client_totals(results):
+    totals = {"income": 0.0, "tax": 0.0}
+    for res in results.values():
+        totals["income"] += sum(float(res[name]) for name in incomeFields if res.get(name) is not None)
+        totals["tax"] += sum(float(res[name]) for name in taxFields if res.get(name) is not None)
+    return {name: round(value, 2) for name, value in totals.items()}
+
+
+def run_client(client, incremental, dump, formats, cache, years, from_year, db_name, source, rates):
+    """Расчет одного клиента; весь вывод, состояние, кэш и документы - в его папке output"""
+    output = client["output"]
+    os.makedirs(output, exist_ok=True)
+    summary = {"name": client["name"], "output": output, "years": [], "status": "ok", "error": None}
+    start = time.perf_counter()
+    with open(os.path.join(output, "log.txt"), "w", encoding="utf8") as log, contextlib.redirect_stdout(log), \
+            stage("client", client["name"]):
+        try:
+            yearReports = preprocess_reports(client["reports"])
+            if len(yearReports) == 0:
+                raise FileNotFoundError(f"Не найдено отчетов в папке {client['reports']}")
+            engine = TaxReportEngine(
+                yearReports, client["start_date"], rates=rates, incremental=incremental, rates_db=db_name, rates_source=source,
+                checkpoint_dir=os.path.join(output, checkpointDirName),
+                dump_dir=os.path.join(output, dirname) if dump else None,
+                cache_dir=os.path.join(output, cacheDirName) if cache else None,
+                years=select_years(yearReports, years, from_year),
+            )
+            results = engine.run()
+            engine.write(results, formats, output)
+            summary["years"] = sorted(year for year, res in results.items() if res.calculated())
+            summary.update(client_totals(results))
+        except Exception as e:
+            traceback.print_exc(file=log)
+            summary["status"] = "ошибка"
+            summary["error"] = f"{type(e).__name__}: {e}"
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def shared_rates(clients, db_name=ratesDbName, source=ratesSource):
+    """Одна таблица курсов на всех клиентов: с самой ранней даты открытия счета по конец последнего года"""
+    start_date = min((client["start_date"] for client in clients), key=lambda date: datetime.strptime(date, "%d.%m.%Y"))
+    years = [year for client in clients for year, _ in find_reports(client["reports"])]
+    To = datetime(max(years), 12, 31) if years else None
+    return get_crs_tables(start_date, To, db_name, source)
+
+
+def print_summary(summary):
+    print(f"{'Клиент':<20} {'Статус':<8} {'Годы':<12} {'Доход, руб.':>16} {'Налог, руб.':>14} {'Время, с':>9}")
+    for client in summary:
+        years = f"{client['years'][0]}-{client['years'][-1]}" if client["years"] else "-"
+        income = f"{client['income']:>16.2f}" if "income" in client else f"{'-':>16}"
+        tax = f"{client['tax']:>14.2f}" if "tax" in client else f"{'-':>14}"
+        print(f"{client['name']:<20} {client['status']:<8} {years:<12} {income} {tax} {client['seconds']:>9.2f}")
+    for client in summary:
+        if client["error"]:
+            print(f"{client['name']}: {client['error']} (подробности в {os.path.join(client['output'], 'log.txt')})")
+
+
+def run_batch(manifest, jobs=1, incremental=False, dump=False, db_name=ratesDbName, source=ratesSource, formats=("docx",),
+              cache=True, years=None, from_year=None):
+    """Расчет всех клиентов манифеста в jobs процессах, возвращает итоги по клиентам;
+    years и from_year ограничивают рассчитываемые года, как --years и --from"""
+    start = time.perf_counter()
+    clients = load_manifest(manifest)
+    print(f"Клиентов в манифесте: {len(clients)}")
+    with stage("rates"):
+        rates = shared_rates(clients, db_name, source)
+    jobs = max(1, min(jobs if jobs > 0 else os.cpu_count(), len(clients)))
+    summary = run_jobs(
+        jobs, run_client, clients, [incremental] * len(clients), [dump] * len(clients), [formats] * len(clients),
+        [cache] * len(clients), [years] * len(clients), [from_year] * len(clients), [db_name] * len(clients), [source] * len(clients), rates=rates
+    )
+    print_summary(summary)
+    failed = sum(client["status"] != "ok" for client in summary)
+    print(f"Обработано клиентов: {len(summary) - failed}, с ошибками: {failed}, за {time.perf_counter() - start:.1f} с")
+    return summary
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import os
+import pickle
+import shutil
+import hashlib
+from glob import glob
+from importlib import metadata
+from datetime import datetime
+
+# Результаты расчета по годам, которые не пересчитываются, пока не изменились входные данные
+cacheDirName = "cache"
+cacheVersion = 1
+cacheMaxBytes = 512 * 2 ** 20
+resultName = "result.pkl"
+# Пакеты, от версии которых зависят сохраненные таблицы (pickle) и пояснительные записки
+versionPackages = ["pandas", "numpy", "docxtpl"]
+
+_code_version = None
+
+
+def code_version():
+    """Отпечаток исходного кода пакета и версий versionPackages: результаты другой версии расчета не используются"""
+    global _code_version
+    if _code_version is None:
+        digest = hashlib.sha256(str(cacheVersion).encode())
+        for name in versionPackages:
+            try:
+                digest.update(f"{name}={metadata.version(name)}".encode())
+            except metadata.PackageNotFoundError:
+                digest.update(f"{name}=".encode())
+        package = os.path.dirname(os.path.abspath(__file__))
+        for fname in sorted(glob(os.path.join(package, "*.py"))):
+            digest.update(os.path.basename(fname).encode())
+            with open(fname, "rb") as file:
+                digest.update(file.read())
+        _code_version = digest.hexdigest()
+    return _code_version
+
+
+def year_key(year, digests, rates, start_date, template_digest):
+    """Ключ результата года: код, отчеты за этот и все предыдущие года (от них зависит FIFO),
+    курсы по конец года, дата открытия счета и шаблон записки"""
+    digest = hashlib.sha256()
+    parts = [code_version(), str(year), start_date, template_digest, rates.digest(datetime(year, 12, 31))]
+    parts += [f"{y}:{d}" for y, d in sorted(digests.items()) if y <= year]
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Записи cache_dir/{ключ}: таблицы и суммы года, открытые лоты на его конец, строки сделок и пояснительная записка.
+
+    При превышении max_bytes удаляются записи, которые дольше всего не использовались.
+    """
+
+    def __init__(self, cache_dir=cacheDirName, max_bytes=cacheMaxBytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        path = self.entry_dir(key)
+        try:
+            with open(os.path.join(path, resultName), "rb") as file:
+                entry = pickle.load(file)
+        except Exception:
+            # a broken entry or one that another pandas version cannot unpickle is calculated again
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        path = self.entry_dir(key)
+        os.makedirs(path, exist_ok=True)
+        fname = os.path.join(path, resultName)
+        with open(fname + ".tmp", "wb") as file:
+            pickle.dump(entry, file)
+        os.replace(fname + ".tmp", fname)
+        self.evict()
+
+    def get_file(self, key, target):
+        """Копирует сохраненный в записи key файл с именем target в target, False - если его нет"""
+        fname = os.path.join(self.entry_dir(key), os.path.basename(target))
+        if not os.path.exists(fname):
+            return False
+        shutil.copyfile(fname, target)
+        os.utime(self.entry_dir(key))
+        return True
+
+    def put_file(self, key, fname):
+        path = self.entry_dir(key)
+        if not os.path.isdir(path):
+            return
+        target = os.path.join(path, os.path.basename(fname))
+        shutil.copyfile(fname, target + ".tmp")
+        os.replace(target + ".tmp", target)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in glob(os.path.join(self.cache_dir, "*")):
+            if os.path.isdir(path):
+                size = sum(os.path.getsize(fname) for fname in glob(os.path.join(path, "*")))
+                entries.append((os.path.getmtime(path), size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
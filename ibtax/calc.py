@@ -0,0 +1,297 @@
+# coding: utf-8
+
+import numpy as np
+import pandas as pd
+
+from .instrument import count
+
+# Ключ строки дивиденда и налога: тикер с ISIN в начале описания, как "AAPL(US0378331005)", дата и валюта
+divKey = r"^(\S+)"
+divKeyColumns = ["key", "date", "currency"]
+
+
+# Валюты, суммы переводов по которым есть в результате всегда (cashflow_rub_sum, ...)
+cashflowCurrencies = ["RUB", "USD", "EUR"]
+
+
+def section_rates(rates, *frames):
+    """Курсы ЦБ на даты строк всех frames (столбцы date и currency) одним поиском по всем валютам.
+
+    Возвращает массив курсов на каждый frame (None для None); у разделов только в рублях курс целый, как в get_currencies.
+    """
+    present = [df for df in frames if df is not None]
+    if not present:
+        return [None] * len(frames)
+    curs = [np.asarray(df.currency, dtype=object) for df in present]
+    cur_price = rates.get_currencies(
+        np.concatenate([df.date.to_numpy(dtype="datetime64[ns]") for df in present]), np.concatenate(curs)
+    )
+    parts = iter(zip(np.split(cur_price, np.cumsum([len(df) for df in present])[:-1]), curs))
+    prices = []
+    for df in frames:
+        if df is None:
+            prices.append(None)
+            continue
+        price, cur = next(parts)
+        prices.append(price.astype(int) if (cur == "RUB").all() else price)
+    return prices
+
+
+def section_currencies(frames):
+    """Валюты всех разделов года (столбец currency)"""
+    return set().union(*(df.currency.dropna().unique() for df in frames if df is not None and "currency" in df))
+
+
+def cashflow_calc(year, cashflow):
+    """Таблица переводов, суммы по валютам и типам одной группировкой и суммы по валютам {валюта: сумма}"""
+    print(f"Расчет таблицы переводов за {year} год...")
+    if cashflow is None:
+        print(f"За {year} нет переводов")
+        return None, None, {currency: None for currency in cashflowCurrencies}
+    res = cashflow[["date", "currency", "amount"]].copy()
+    res["type"] = np.where(cashflow.amount.to_numpy() > 0, "Перевод на счет", "Снятие со счета")
+    totals = res.groupby(["currency", "type"], observed=True, as_index=False).amount.sum()
+    by_currency = totals.groupby("currency", observed=True).amount.sum()
+    zero = res.amount.dtype.type(0)
+    currencies = cashflowCurrencies + sorted(set(by_currency.index) - set(cashflowCurrencies))
+    sums = {currency: by_currency.get(currency, zero).round(2) for currency in currencies}
+    print(f"За {year} год:")
+    print(res)
+    for currency, value in sums.items():
+        print(f"{currency.capitalize()}: {value}")
+    return res, totals, sums
+
+
+def div_keys(df):
+    return pd.DataFrame({
+        "key": df.description.astype(str).str.extract(divKey, expand=False).values,
+        "date": df.date.values,
+        "currency": df.currency.astype(str).values,
+        "amount": df.amount.values,
+    })
+
+
+def withheld_sums(div_tax):
+    """Удержанный налог по выплатам (столбцы divKeyColumns и withheld)"""
+    return div_keys(div_tax).groupby(divKeyColumns, as_index=False).amount.sum().rename(columns={"amount": "withheld"})
+
+
+def div_tax_unmatched(div, div_tax, withheld=None, gross=None):
+    """Выплаты удержанного налога, для которых нет дивидендов (столбцы divKeyColumns, withheld и gross)"""
+    if withheld is None and div is not None:
+        # usually every tax row has its dividend and there are no reversals: check that with sets, without grouping
+        dividends = div_keys(div)
+        known = set(zip(dividends.key, dividends.date, dividends.currency))
+        tax = div_keys(div_tax)
+        if (dividends.amount.to_numpy() > 0).all() and known.issuperset(zip(tax.key, tax.date, tax.currency)):
+            return pd.DataFrame(columns=divKeyColumns + ["withheld", "gross"])
+    if withheld is None:
+        withheld = withheld_sums(div_tax)
+    if div is None:
+        return withheld[withheld.withheld != 0].assign(gross=np.nan)
+    if gross is None:
+        gross = div_keys(div).groupby(divKeyColumns, as_index=False).amount.sum().rename(columns={"amount": "gross"})
+    payments = withheld.merge(gross, on=divKeyColumns, how="left")
+    return payments[(payments.gross.fillna(0) == 0) & (payments.withheld != 0)]
+
+
+def div_tax_paid(div, div_tax):
+    """Удержанный налог для каждой строки дивидендов.
+
+    Строки обеих таблиц сопоставляются по тикеру, дате и валюте; сторно и несколько удержаний
+    по одной выплате суммируются, налог делится между дивидендами выплаты пропорционально сумме.
+    Дивиденды без налога получают 0, налог без дивидендов выводится и не учитывается (см. check_div_tax).
+    """
+    dividends = div_keys(div)
+    gross = dividends.groupby(divKeyColumns, as_index=False).amount.sum().rename(columns={"amount": "gross"})
+    withheld = withheld_sums(div_tax)
+    rows = dividends.merge(gross, on=divKeyColumns, how="left").merge(withheld, on=divKeyColumns, how="left")
+    share = np.divide(rows.amount.values, rows.gross.values, out=np.zeros(len(rows)), where=rows.gross.values != 0)
+    # 0.0 - x instead of -x: dividends without tax get 0.0, not -0.0
+    paid = 0.0 - rows.withheld.fillna(0).values * share
+
+    no_tax = rows[rows.withheld.isna()]
+    if len(no_tax):
+        print(f"Дивиденды без удержанного налога ({len(no_tax)}), налог по ним будет 13%:")
+        print(no_tax[["key", "date", "currency", "amount"]].to_string(index=False, header=False))
+    no_div = div_tax_unmatched(div, div_tax, withheld, gross)
+    if len(no_div):
+        print(f"Удержанный налог без дивидендов ({len(no_div)}), не учитывается:")
+        print(no_div[["key", "date", "currency", "withheld"]].to_string(index=False, header=False))
+    count("div_unmatched", len(no_tax) + len(no_div))
+    return paid
+
+
+def div_calc(year, div, div_tax, cur_price):
+    print(f"Расчет таблицы дивидендов за {year} год...")
+    if div is None:
+        print(f"За {year} нет дивидендов")
+        return None
+
+    res = pd.DataFrame()
+    res["ticker"] = div.description.str.split(" Cash Dividend").str[0].values
+    res["date"] = div["date"].values
+    res["amount"] = div["amount"].values.round(2)
+    res["currency"] = div["currency"].values
+    if div_tax is None:
+        print("Не найдена таблица удержанного налога с дивидендов. Налог на дивиденды будет 13%")
+    res["tax_paid"] = div_tax_paid(div, div_tax).round(2) if div_tax is not None else 0
+    res["cur_price"] = cur_price
+    res["amount_rub"] = (res.amount * res.cur_price).round(2)
+    res["tax_paid_rub"] = (res.tax_paid * res.cur_price).round(2)
+    res["tax_full_rub"] = (res.amount_rub * 13 / 100).round(2)
+    res["tax_rest_rub"] = (res.tax_full_rub - res.tax_paid_rub).round(2)
+
+    return res
+
+
+def div_accurals_calc(year, div_accurals, cur_price):
+    print(f"Расчет таблицы корректировки дивидендов за {year} год...")
+    if div_accurals is None:
+        print(f"За {year} нет корректировки дивидендов")
+        return None
+    res = pd.DataFrame()
+    res["ticker"] = div_accurals['symbol']
+    res["date"] = div_accurals["date"]
+    res["amount"] = div_accurals["gross amount"].round(2)
+    res["currency"] = div_accurals["currency"].values
+    res["tax_paid"] = div_accurals["tax"].round(2)
+    res["cur_price"] = cur_price
+    res["amount_rub"] = (res.amount * res.cur_price).round(2)
+    res["tax_paid_rub"] = (res.tax_paid * res.cur_price).round(2)
+    res["tax_full_rub"] = (res.amount_rub * 13 / 100).round(2)
+    res["tax_rest_rub"] = (res.tax_full_rub - res.tax_paid_rub).round(2)
+    return res
+
+
+def fees_calc(year, comissions, cur_price):
+    print(f"Расчет таблицы комиссий за {year} год...")
+    if comissions is None:
+        print(f"За {year} нет комиссий")
+        return None
+    fees = pd.DataFrame()
+    fees["date"] = comissions.date
+    fees["fee"] = comissions.amount * -1
+    fees["currency"] = comissions["currency"].values
+    fees["cur_price"] = cur_price
+    fees["fee_rub"] = (fees.fee * fees.cur_price).round(2)
+    return fees
+
+
+def interest_calc(year, interests, cur_price):
+    print(f"Расчет таблицы по программе повышения доходности за {year} год...")
+    if interests is None:
+        print(f"За {year} нет повышенной доходности")
+        return None
+    interest_calc = pd.DataFrame()
+    interest_calc["date"] = interests.date
+    interest_calc["description"] = interests.description
+    interest_calc["currency"] = interests.currency
+    interest_calc["amount"] = interests.amount
+    interest_calc["cur_price"] = cur_price
+    interest_calc["amount_rub"] = (interest_calc.amount * interest_calc.cur_price).round(2)
+    interest_calc["rest"] = (interest_calc.amount * interest_calc.cur_price * 0.13).round(2)
+    interest_calc = interest_calc.sort_values(['date'])
+    return interest_calc
+
+
+def year_results(year, cashflow, comissions, div, div_tax, div_accurals, interests, rates):
+    res = {}
+
+    res["cashflow_res"], res["cashflow_totals_res"], sums = cashflow_calc(year, cashflow)
+    for currency, value in sums.items():
+        res[f"cashflow_{currency.lower()}_sum"] = value
+
+    # every money section is converted to rubles with one rates lookup
+    div_price, div_accurals_price, fees_price, interest_price = section_rates(rates, div, div_accurals, comissions, interests)
+
+    res["div_res"] = div_calc(year, div, div_tax, div_price)
+    if res["div_res"] is None:
+        res["div_sum"] = None
+        res["div_tax_paid_rub_sum"] = None
+        res["div_tax_full_rub_sum"] = None
+        res["div_tax_rest_sum"] = None
+    else:
+        res["div_sum"] = round(res["div_res"].amount_rub.sum(), 2)
+        res["div_tax_paid_rub_sum"] = round(res["div_res"].tax_paid_rub.sum(), 2)
+        res["div_tax_full_rub_sum"] = round(res["div_res"].tax_full_rub.sum(), 2)
+        res["div_tax_rest_sum"] = round(res["div_res"].tax_rest_rub.sum(), 2)
+        print(f"Дивидендов за {year} год: {res['div_sum']} Rub")
+
+    res["div_accurals_res"] = div_accurals_calc(year, div_accurals, div_accurals_price)
+    if res["div_accurals_res"] is None:
+        res["div_accurals_sum"] = None
+        res["div_accurals_tax_paid_rub_sum"] = None
+        res["div_accurals_tax_full_rub_sum"] = None
+        res["div_accurals_tax_rest_sum"] = None
+    else:
+        res["div_accurals_sum"] = res["div_accurals_res"].amount_rub.sum().round(2)
+        res["div_accurals_tax_paid_rub_sum"] = res["div_accurals_res"].tax_paid_rub.sum().round(2)
+        res["div_accurals_tax_full_rub_sum"] = res["div_accurals_res"].tax_full_rub.sum().round(2)
+        res["div_accurals_tax_rest_sum"] = res["div_accurals_res"].tax_rest_rub.sum().round(2)
+        print(f"Корретктировка дивидендов за {year} год: {res['div_accurals_sum']} Rub")
+
+    if res["div_tax_rest_sum"] is None and res["div_accurals_tax_rest_sum"] is None:
+        res["div_final_tax_rest_sum"] = None
+        res["div_final_sum"] = None
+        res["div_tax_paid_final_sum"] = None
+        res["div_tax_need_pay_final_sum"] = None
+    else:
+        # a statement may have dividends without accruals or the other way round, the missing part adds 0
+        def final(div_name, accurals_name):
+            return round(sum(res[name] for name in (div_name, accurals_name) if res[name] is not None), 2)
+
+        res["div_final_tax_rest_sum"] = final("div_tax_rest_sum", "div_accurals_tax_rest_sum")
+        res["div_final_sum"] = final("div_sum", "div_accurals_sum")
+        res["div_tax_paid_final_sum"] = final("div_tax_paid_rub_sum", "div_accurals_tax_paid_rub_sum")
+        res["div_tax_need_pay_final_sum"] = final("div_tax_rest_sum", "div_accurals_tax_rest_sum")
+
+    res["fees_res"] = fees_calc(year, comissions, fees_price)
+    if res["fees_res"] is None:
+        res["fees_rub_sum"] = None
+    else:
+        res["fees_rub_sum"] = res["fees_res"].fee_rub.sum().round(2)
+        print(f"Комиссий за {year} год: {res['fees_rub_sum']} Rub")
+
+    res["interest_res"] = interest_calc(year, interests, interest_price)
+    if res["interest_res"] is None:
+        res["interest_rub_sum"] = None
+        res["interest_rest_sum"] = None
+    else:
+        res["interest_rub_sum"] = res["interest_res"].amount_rub.sum().round(2)
+        res["interest_rest_sum"] = res["interest_res"].rest.sum().round(2)
+
+    return res
+
+
+def trade_amounts(rows, rates):
+    """Строки сделок, сгруппированные как в пояснительной записке, с суммами в рублях; строки разных тикеров не объединяются"""
+    internal_trades_res = rows.copy()
+    if len(internal_trades_res):
+        internal_trades_res = internal_trades_res.groupby(['ticker', 'der_type', 'date', 'price', 'fee', 'currency', 'proceeds'], as_index=False)['cnt'].sum()
+    internal_trades_res["type"] = ["Покупка" if cnt > 0 else "Продажа" for cnt in internal_trades_res.cnt]
+    internal_trades_res["price"] = internal_trades_res.price.round(2)
+    # 0.0 - x instead of -x: lifecycle trades without a fee get 0.0, not -0.0
+    internal_trades_res["fee"] = 0.0 - internal_trades_res.fee.round(2)
+    internal_trades_res["amount"] = (internal_trades_res.proceeds - internal_trades_res.fee).round(2)
+    internal_trades_res["cur_price"] = rates.get_currencies(internal_trades_res.date, internal_trades_res.currency)
+    internal_trades_res["amount_rub"] = (internal_trades_res.amount * internal_trades_res.cur_price).round(2)
+    internal_trades_res["rest"] = (internal_trades_res.amount * internal_trades_res.cur_price * 0.13).round(2)
+    internal_trades_res["cnt"] = internal_trades_res.cnt.abs()
+    return internal_trades_res
+
+
+def trades_calc(rows, rates):
+    res = {}
+    internal_trades_res = trade_amounts(rows, rates)
+    internal_trades_res = internal_trades_res.sort_values(["ticker", "type", "date"])
+    internal_trades_res.loc[internal_trades_res.duplicated(subset="ticker"), "ticker"] = ""
+
+    res["income_rub_sum_cb"] = round(internal_trades_res[internal_trades_res.der_type == ''].amount_rub.sum(), 2)
+    res["income_rest_sum_cb"] = round(internal_trades_res[internal_trades_res.der_type == ''].amount_rub.sum() * 0.13, 2)
+
+    res["income_rub_sum_pfi"] = round(internal_trades_res[internal_trades_res.der_type != ''].amount_rub.sum(), 2)
+    res["income_rest_sum_pfi"] = round(internal_trades_res[internal_trades_res.der_type != ''].amount_rub.sum() * 0.13, 2)
+
+    res["trades_res"] = internal_trades_res
+    return res
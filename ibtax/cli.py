@@ -0,0 +1,142 @@
+# coding: utf-8
+
+import json
+import logging
+import argparse
+
+from .rates import ratesDbName, ratesSource
+from .statement import preprocess_reports, reportDirName, dirname
+from .lots import checkpointDirName
+from .engine import TaxReportEngine, select_years
+from .cache import cacheDirName
+from .batch import run_batch
+from .sinks import sinks
+from .prices import PriceService, StubPrices, yfinance_prices
+from .optimize import harvest_report
+from .scenario import plan_report
+from . import instrument
+
+
+outputFormats = ["docx", *sinks]
+
+
+def formats(value):
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in outputFormats]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(f"неизвестный формат {', '.join(unknown)}")
+    return names
+
+
+def years(value):
+    """Года через запятую, диапазоны через дефис: 2024, 2021-2024, 2019,2021-2022"""
+    selected = set()
+    try:
+        for part in value.split(","):
+            first, _, last = part.strip().partition("-")
+            selected.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"неверный список годов {value}")
+    if not selected:
+        raise argparse.ArgumentTypeError(f"пустой список годов {value}")
+    return selected
+
+
+def parquet_available():
+    for module in ("pyarrow", "fastparquet"):
+        try:
+            __import__(module)
+            return True
+        except ImportError:
+            pass
+    return False
+
+
+def main(argv=None, start_date=None):
+    parser = argparse.ArgumentParser(description="Пояснительная записка к декларации 3-НДФЛ по отчетам Interactive Brokers")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="число процессов для обработки годов (по умолчанию 1, 0 - по числу ядер)")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"продолжить с сохраненного в {checkpointDirName} состояния и обработать только новые года")
+    parser.add_argument("--start-date", default=start_date, help="дата открытия счета ДД.ММ.ГГГГ, с нее загружаются курсы валют")
+    parser.add_argument("--reports", default=reportDirName, help=f"папка с отчетами YEAR.csv или *.csv с периодом в разделе Statement (по умолчанию {reportDirName})")
+    parser.add_argument("--years", type=years, default=None,
+                        help="рассчитать только эти года (2024, 2021-2024, 2019,2021): из отчетов за предыдущие года читаются только сделки")
+    parser.add_argument("--from", dest="from_year", type=int, default=None, metavar="YEAR",
+                        help="рассчитать года начиная с YEAR, из более ранних отчетов читаются только сделки")
+    parser.add_argument("--dump", action="store_true", help=f"сохранить разделы отчетов в {dirname} для отладки")
+    parser.add_argument("--rates-source", default=ratesSource, help="адрес cbr.ru или папка с файлами {ВАЛЮТА}.xlsx")
+    parser.add_argument("--rates-db", default=ratesDbName, help=f"файл хранилища курсов (по умолчанию {ratesDbName})")
+    parser.add_argument("--batch", metavar="MANIFEST", default=None,
+                        help="json файл со списком клиентов (name, start_date, reports, output): курсы загружаются один раз, "
+                             "клиенты обрабатываются в --jobs процессах")
+    parser.add_argument("--format", default="docx", type=formats,
+                        help=f"форматы результатов через запятую: {', '.join(outputFormats)} (по умолчанию docx)")
+    parser.add_argument("--output", default=".", help="папка для результатов (по умолчанию текущая)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"не использовать кэш результатов в {cacheDirName} (года с неизменными отчетами, курсами и шаблоном не пересчитываются)")
+    parser.add_argument("--optimize", action="store_true",
+                        help="предложить продажи открытых лотов с убытком, уменьшающие налог года (цены из yfinance)")
+    parser.add_argument("--optimize-year", metavar="YEAR", type=int, default=None,
+                        help="год, доход которого уменьшает --optimize (по умолчанию последний рассчитанный)")
+    parser.add_argument("--prices", metavar="FILE", default=None, help="json файл {тикер: цена} вместо yfinance для --optimize")
+    parser.add_argument("--plan", metavar="FILE", default=None,
+                        help="json файл с планируемыми сделками [{symbol, date, quantity, price, currency}]: "
+                             "вывести доход и налог по сделкам с их учетом")
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="сохранить время, счетчики строк и запросов курсов по этапам в FILE (json) и стеки для flamegraph в FILE.folded")
+    parser.add_argument("--profile-memory", action="store_true", help="добавить в профиль пик памяти этапов (tracemalloc, медленнее)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="выводить время и счетчики каждого этапа в stderr")
+    args = parser.parse_args(argv)
+    if "parquet" in args.format and not parquet_available():
+        parser.error("для формата parquet установите pyarrow: pip install pyarrow")
+
+    if args.verbose:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        instrument.log.addHandler(handler)
+        instrument.log.setLevel(logging.DEBUG)
+    if args.profile or args.verbose or args.profile_memory:
+        instrument.enable(memory=args.profile_memory)
+    try:
+        return run(parser, args)
+    finally:
+        profile = instrument.disable()
+        if args.profile and profile is not None:
+            fnames = instrument.write_profile(profile, args.profile)
+            print(f"Профиль запуска сохранен в {', '.join(fnames)}")
+
+
+def run(parser, args):
+    if args.batch:
+        summary = run_batch(args.batch, args.jobs, args.incremental, args.dump, args.rates_db, args.rates_source, args.format,
+                            not args.no_cache, args.years, args.from_year)
+        return 1 if any(client["status"] != "ok" for client in summary) else 0
+    if args.start_date is None:
+        parser.error("укажите --start-date")
+
+    yearReports = preprocess_reports(args.reports)
+
+    if len(yearReports) == 0:
+        print(f"Не найдено отчетов в папке {args.reports}.")
+        print("Проверьте, что в ней есть отчеты в csv формате, названные по шаблону YEAR.csv или с периодом отчета в разделе Statement")
+        return
+
+    engine = TaxReportEngine(
+        yearReports, args.start_date, jobs=args.jobs, incremental=args.incremental, checkpoint_dir=checkpointDirName,
+        rates_db=args.rates_db, rates_source=args.rates_source, dump_dir=dirname if args.dump else None,
+        cache_dir=None if args.no_cache else cacheDirName, years=select_years(yearReports, args.years, args.from_year),
+    )
+    results = engine.run()
+
+    if args.optimize:
+        if args.prices:
+            with open(args.prices, encoding="utf8") as file:
+                provider = StubPrices(json.load(file))
+        else:
+            provider = yfinance_prices
+        harvest_report(engine, results, PriceService(provider), args.optimize_year)
+    if args.plan:
+        with open(args.plan, encoding="utf8") as file:
+            plan_report(engine, results, json.load(file))
+
+    engine.write(results, args.format, args.output)
@@ -0,0 +1,363 @@
+# coding: utf-8
+
+import io
+import os
+import re
+import zipfile
+
+from .instrument import stage, count
+
+templateName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "template.docx")
+docName = "Пояснительная записка {year}.docx"
+
+# Таблицы длиннее стольких строк выводятся напрямую в XML, минуя цикл jinja
+fastRowsMin = 500
+
+sumNames = [
+    'div_sum', 'div_tax_paid_rub_sum', 'div_tax_full_rub_sum', 'div_tax_rest_sum',
+    'div_accurals_sum', 'div_accurals_tax_paid_rub_sum', 'div_accurals_tax_full_rub_sum', 'div_accurals_tax_rest_sum',
+    'div_final_tax_rest_sum', 'div_final_sum', 'div_tax_paid_final_sum', 'div_tax_need_pay_final_sum',
+    'interest_rub_sum', 'interest_rest_sum',
+    'income_rub_sum_cb', 'income_rest_sum_cb', 'income_rub_sum_pfi', 'income_rest_sum_pfi',
+    'fees_rub_sum',
+]
+
+documentPart = "word/document.xml"
+wordNs = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+loopTag = re.compile(r"\{%\s*for\s+(\w+)\s+in\s+(\w+)\s*%\}((?:(?!\{%).)*?)\{%\s*endfor\s*%\}", re.DOTALL)
+exprTag = re.compile(r"\{\{(.*?)\}\}", re.DOTALL)
+bodyTag = re.compile(rb"<w:body(\s[^>]*)?>")
+nsDecl = re.compile(rb'\s+xmlns:(\w+)="([^"]*)"')
+# the field placeholders of a row template, private use characters survive the lxml round trip as is
+fieldMark = re.compile("\ue000(\\d+)\ue001")
+textStart = re.compile(r"<w:t(?: [^>]*)?>$")
+# values that docxtpl would treat as markup or as a listing (tab, new line...) go the regular way
+unsafeText = re.compile(r"[&<>\x00-\x1f]|\{_|_\}")
+# Методы DocxTemplate вне его публичного API, на которых построен ReportTemplate (проверены с docxtpl 0.20);
+# счетчик docx_ids_index для fix_docpr_ids() задается перед каждым вызовом, как в render_init()
+docxtplInternals = ["init_docx", "get_xml", "patch_xml", "resolve_listing", "fix_tables", "fix_docpr_ids"]
+rowWidth = "count(w:tc[not(w:tcPr/w:gridSpan)]) + sum(w:tc/w:tcPr/w:gridSpan[1]/@w:val)"
+
+
+def post_process(xml):
+    """Обработка текста после jinja, как в DocxTemplate.render_xml_part()"""
+    xml = xml.replace("\n<w:p ", "<w:p ").replace("\n<w:p>", "<w:p>")
+    return xml.replace("{_{", "{{").replace("}_}", "}}").replace("{_%", "{%").replace("%_}", "%}")
+
+
+def parse_xml(xml):
+    from lxml import etree
+
+    return etree.fromstring(xml, parser=etree.XMLParser(recover=True))
+
+
+class Row:
+    """Строка таблицы для шаблона: item.column читается из столбцов TableRows"""
+    __slots__ = ("_columns", "_values")
+
+    def __init__(self, columns, values):
+        self._columns = columns
+        self._values = values
+
+    def __getattr__(self, name):
+        try:
+            return self._values[self._columns[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __getitem__(self, name):
+        return self._values[self._columns[name]]
+
+
+class TableRows:
+    """Строки DataFrame для цикла шаблона без построения списка словарей (to_dict(orient='records'))"""
+
+    def __init__(self, df):
+        self.names = [] if df is None else list(df.columns)
+        self.columns = {name: n for n, name in enumerate(self.names)}
+        # tolist() boxes numpy scalars into python values the same way to_dict() does
+        self.data = [] if df is None else [df[name].tolist() for name in self.names]
+        self.size = 0 if df is None else len(df)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        columns = self.columns
+        for values in zip(*self.data):
+            yield Row(columns, values)
+
+    def column(self, name):
+        return self.data[self.columns[name]] if name in self.columns else None
+
+
+class FastLoop:
+    """Строки таблицы {%tr for item in tbl %} с подстановками item.column / item.column.strftime('...'),
+    записываемые сразу в том виде, в каком их сохранил бы lxml после рендеринга jinja"""
+
+    def __init__(self, index, var, table, body, body_tag):
+        from lxml import etree
+
+        self.table = table
+        self.marker = f"<!--ibtax-fast-rows-{index}-->"
+        self.fields = []
+        row = []
+        pos = 0
+        for m in exprTag.finditer(body):
+            expr = m.group(1).strip()
+            attr = re.fullmatch(rf"{var}\.(\w+)", expr)
+            date = re.fullmatch(rf"{var}\.(\w+)\.strftime\('([^']*)'\)", expr)
+            if attr:
+                self.fields.append([attr.group(1), None, None])
+            elif date:
+                self.fields.append([date.group(1), date.group(2), None])
+            else:
+                raise ValueError(expr)
+            row.append(body[pos:m.start()])
+            row.append(f"\ue000{len(self.fields) - 1}\ue001")
+            pos = m.end()
+        row.append(body[pos:])
+
+        # the row as lxml writes it inside the document body
+        root = parse_xml(body_tag + post_process("".join(row)) + "</w:body>")
+        if root.text or any(child.tag != f"{{{wordNs}}}tr" or child.tail for child in root) or len(root) == 0:
+            raise ValueError("not a table row")
+        if b"docPr" in etree.tostring(root):
+            raise ValueError("pictures are renumbered")
+        ns = {"w": wordNs}
+        self.cells = max(len(tr.findall(f"{{{wordNs}}}tc")) for tr in root)
+        self.width = max(tr.xpath(rowWidth, namespaces=ns) for tr in root)
+        xml = etree.tostring(root, encoding="unicode")
+        xml = xml[xml.index(">") + 1:xml.rindex("</w:body>")]
+        pieces = fieldMark.split(xml)
+        if [int(n) for n in pieces[1::2]] != list(range(len(self.fields))):
+            raise ValueError("fields moved")
+        literals = pieces[::2]
+        for n, field in enumerate(self.fields):
+            before = "".join(literals[:n + 1])
+            if 0 < n < len(literals) - 1 and not literals[n] or before.rfind("<") > before.rfind(">"):
+                raise ValueError("fields must be separate texts")
+            # lxml writes an empty <w:t></w:t> as <w:t/>, so a field filling the whole text element carries its tags
+            start = textStart.search(literals[n])
+            if start and literals[n + 1].startswith("</w:t>"):
+                field[2] = start.group(0)
+                literals[n] = literals[n][:start.start()]
+                literals[n + 1] = literals[n + 1][len("</w:t>"):]
+        self.format = "%s".join(literal.replace("%", "%%") for literal in literals)
+
+    def render(self, rows):
+        """Строки таблицы в XML или None, если их нужно выводить через jinja"""
+        columns = []
+        for name, date_format, text_tag in self.fields:
+            values = rows.column(name)
+            if values is None:
+                return None
+            if date_format is None:
+                values = list(map(str, values))
+            else:
+                values = [value.strftime(date_format) for value in values]
+            if unsafeText.search("".join(values)):
+                return None
+            if text_tag is not None:
+                empty = text_tag[:-1] + "/>"
+                values = [text_tag + value + "</w:t>" if value else empty for value in values]
+            columns.append(values)
+        fmt = self.format
+        return "".join(fmt % values for values in zip(*columns))
+
+
+class ReportTemplate:
+    """Шаблон пояснительной записки, разобранный и скомпилированный один раз.
+
+    Результат совпадает с DocxTemplate.render(): тот же текст шаблона после patch_xml() компилируется
+    в jinja один раз, строки длинных таблиц записываются в XML напрямую, а документ собирается
+    из готовых частей шаблона, если jinja-теги есть только в основном тексте.
+    Если в установленной версии docxtpl нет нужных методов (docxtplInternals), документ формируется
+    обычными DocxTemplate.render() и save().
+    """
+
+    def __init__(self, template=templateName):
+        from docxtpl import DocxTemplate
+        from jinja2 import Template
+
+        self.template = template
+        with open(template, "rb") as file:
+            self.source = file.read()
+        self.docx = DocxTemplate(io.BytesIO(self.source))
+        if callable(getattr(self.docx, "init_docx", None)):
+            self.docx.init_docx()
+        missing = [name for name in docxtplInternals if not hasattr(self.docx, name)]
+        if missing:
+            print(f"В docxtpl нет {', '.join(missing)}, пояснительные записки формируются через DocxTemplate.render()")
+            self.loops = {}
+            self.parts = None
+            return
+        # same preparation as DocxTemplate.build_xml() and render_xml_part()
+        src_xml = re.sub(r"<w:p([ >])", r"\n<w:p\1", self.docx.patch_xml(self.docx.get_xml()))
+        body_tag = re.match(r"<w:body[^>]*>", src_xml).group(0)
+        self.loops = {}
+
+        def fast_loop(m):
+            try:
+                loop = FastLoop(len(self.loops), m.group(1), m.group(2), m.group(3), body_tag)
+            except ValueError:
+                return m.group(0)
+            name = f"_fast_rows_{len(self.loops)}"
+            self.loops[name] = loop
+            return f"{{% if {name} is defined %}}{{{{ {name} }}}}{{% else %}}{m.group(0)}{{% endif %}}"
+
+        self.jinja = Template(loopTag.sub(fast_loop, src_xml))
+        self.parts = self.static_parts()
+
+    def static_parts(self):
+        """Части документа, не зависящие от данных, как их сохраняет docxtpl, или None,
+        если теги есть не только в основном тексте"""
+        from docxtpl import DocxTemplate
+
+        with zipfile.ZipFile(io.BytesIO(self.source)) as zin:
+            for name in zin.namelist():
+                if name != documentPart and name.endswith(".xml") and re.search(rb"\{[{%#]", zin.read(name)):
+                    return None
+        docx = DocxTemplate(io.BytesIO(self.source))
+        docx.render({})
+        out = io.BytesIO()
+        docx.save(out)
+        with zipfile.ZipFile(out) as zout:
+            parts = [(name, zout.read(name)) for name in zout.namelist()]
+            document = zout.read(documentPart)
+        # document.xml around the body: <w:body> is the last child of <w:document>
+        start = bodyTag.search(document).start()
+        end = document.rindex(b"</w:document>")
+        self.documentHead = document[:start]
+        self.documentTail = document[end:]
+        self.rootNs = dict(nsDecl.findall(document[:document.index(b">", document.index(b"<w:document"))]))
+        return parts
+
+    def render_tree(self, context, fast=True):
+        """Дерево w:body и строки таблиц {маркер: XML}, которые нужно вставить после его сохранения"""
+        from lxml import etree
+
+        values = dict(context)
+        rows = {}
+        for name, loop in self.loops.items():
+            table = context.get(loop.table)
+            if fast and isinstance(table, TableRows) and len(table) >= fastRowsMin:
+                text = loop.render(table)
+                if text is not None:
+                    values[name] = loop.marker
+                    rows[loop] = text
+        xml = post_process(self.jinja.render(values))
+        if any(char in xml for char in "\t\a\n\f"):
+            xml = self.docx.resolve_listing(xml)
+        tree = parse_xml(xml)
+
+        # the rows written directly count in the checks of fix_tables() as if they were in the tree
+        extra = {}
+        if rows:
+            markers = {f"<!--{comment.text}-->": comment for comment in tree.iter(etree.Comment)}
+            for loop in rows:
+                comment = markers.get(loop.marker)
+                if comment is None or comment.getparent().tag != f"{{{wordNs}}}tbl":
+                    return self.render_tree(context, fast=False)
+                for t in comment.iterancestors(f"{{{wordNs}}}tbl"):
+                    cells, width = extra.get(t, (0, 0))
+                    extra[t] = (max(cells, loop.cells), max(width, loop.width))
+        if tables_need_fix(tree, extra):
+            if rows:
+                return self.render_tree(context, fast=False)
+            tree = self.docx.fix_tables(xml)
+        self.docx.docx_ids_index = 1000
+        self.docx.fix_docpr_ids(tree)
+        return tree, {loop.marker.encode(): text for loop, text in rows.items()}
+
+    def save_docxtpl(self, context, fname):
+        from docxtpl import DocxTemplate
+
+        doc = DocxTemplate(io.BytesIO(self.source))
+        doc.render(context)
+        doc.save(fname)
+
+    def save(self, context, fname):
+        from lxml import etree
+
+        if self.parts is None:
+            return self.save_docxtpl(context, fname)
+        tree, rows = self.render_tree(context)
+        if not tree.xpath("./w:p/w:pPr/w:sectPr | ./w:sectPr", namespaces={"w": wordNs}):
+            # values with markup broke the body: docxtpl then finds no sections and leaves footnotes as they are
+            return self.save_docxtpl(context, fname)
+        body = etree.tostring(tree, encoding="UTF-8")
+        # inside <w:document> the body does not repeat namespace declarations of the root
+        head = bodyTag.match(body)
+        attrs = nsDecl.sub(
+            lambda m: b"" if self.rootNs.get(m.group(1)) == m.group(2) else m.group(0), head.group(1) or b""
+        )
+        document = [self.documentHead, b"<w:body", attrs, b">"]
+        pos = head.end()
+        for marker, text in sorted(rows.items(), key=lambda item: body.index(item[0])):
+            at = body.index(marker, pos)
+            document += [body[pos:at], text.encode("utf8")]
+            pos = at + len(marker)
+        document += [body[pos:], self.documentTail]
+        with zipfile.ZipFile(fname, "w", compression=zipfile.ZIP_DEFLATED) as zout:
+            for name, data in self.parts:
+                zout.writestr(name, b"".join(document) if name == documentPart else data)
+
+
+def tables_need_fix(tree, extra=None):
+    """Условия DocxTemplate.fix_tables(): есть строка с большим числом ячеек, чем в сетке таблицы,
+    или нет ни одной строки на всю ширину сетки (с учетом gridSpan); extra - {таблица: (ячеек, ширина)}
+    строк, которых нет в дереве"""
+    ns = {"w": wordNs}
+    extra = extra or {}
+    for t in tree.iter(f"{{{wordNs}}}tbl"):
+        columns = int(t.xpath("count(w:tblGrid/w:gridCol)", namespaces=ns))
+        cells, width = extra.get(t, (0, 0))
+        if cells > columns or t.xpath("boolean(.//w:tr[count(w:tc) > $n])", namespaces=ns, n=columns):
+            return True
+        if width >= columns:
+            continue
+        # usually the very first row spans the whole grid
+        for row in t.iter(f"{{{wordNs}}}tr"):
+            if row.xpath(rowWidth, namespaces=ns) >= columns:
+                break
+        else:
+            return True
+    return False
+
+
+_templates = {}
+
+
+def compiled_template(template=templateName):
+    """ReportTemplate на процесс: разбирается один раз для всех годов и клиентов"""
+    key = (os.path.abspath(template), os.path.getmtime(template))
+    if key not in _templates:
+        _templates[key] = ReportTemplate(template)
+    return _templates[key]
+
+
+def create_doc(year, res, start_date, template=templateName, outdir="."):
+    with stage("create_doc", year):
+        Fname = os.path.join(outdir, docName.format(year=year))
+        print(f"Формирование отчета за {year} год...")
+        trades_res = res["trades_res"]
+        context = {
+            'start_date': start_date,
+            'year': year,
+            'tbl_div': TableRows(res["div_res"]),
+            'tbl_div_accurals': TableRows(res["div_accurals_res"]),
+            'tbl_cashflow': TableRows(res["cashflow_res"]),
+            # stocks
+            'tbl_trades_cb': TableRows(trades_res[trades_res.der_type == ''] if trades_res is not None else None),
+            # derivatives
+            'tbl_trades_pfi': TableRows(trades_res[trades_res.der_type != ''] if trades_res is not None else None),
+            'tbl_interest': TableRows(res["interest_res"]),
+            'tbl_fees': TableRows(res["fees_res"]),
+        }
+        for name in sumNames:
+            context[name] = res[name]
+        count("doc_rows", sum(len(value) for value in context.values() if isinstance(value, TableRows)))
+        compiled_template(template).save(context, Fname)
+    return Fname
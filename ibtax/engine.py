@@ -0,0 +1,340 @@
+# coding: utf-8
+
+import os
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from .rates import get_crs_tables, ratesDbName, ratesSource
+from .statement import split_report, load_data, clear_dump_dir, report_year
+from .lots import file_digest, load_checkpoint, proceed_trades, assets_state, restore_assets
+from .calc import year_results, trades_calc, section_currencies
+from .doc import create_doc, templateName, docName
+from .cache import ResultCache, year_key
+from .validate import (
+    check_schema, check_sections, check_rates, check_div_tax, check_positions, lot_positions, problems_frame, print_problems, print_report
+)
+from .sinks import sinks
+from . import instrument
+from .instrument import stage
+
+
+class YearResult(dict):
+    """Результаты расчета за год: таблицы (DataFrame) и суммы под именами переменных шаблона"""
+
+    def __init__(self, year, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.year = year
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def tables(self):
+        """Непустые таблицы: {"div": DataFrame, ...} (ключи *_res без суффикса)"""
+        return {
+            name[:-len("_res")]: value for name, value in self.items()
+            if isinstance(value, pd.DataFrame) and name.endswith("_res") and len(value)
+        }
+
+    def totals(self):
+        """Суммы: {"div_sum": ..., ...}, None - нет данных"""
+        return {name: value for name, value in self.items() if not isinstance(value, pd.DataFrame)}
+
+    def calculated(self):
+        """Год рассчитан; у отчета, не прошедшего проверку схемы, есть только validation_res"""
+        return bool(self.totals())
+
+
+_worker_rates = None
+
+
+def _init_worker(rates):
+    global _worker_rates
+    _worker_rates = rates
+
+
+def _with_worker_rates(func, *args):
+    return func(*args, _worker_rates)
+
+
+def run_jobs(jobs, func, *iterables, rates=None):
+    """map по процессам; если передан rates, он будет последним аргументом func"""
+    if jobs == 1:
+        if rates is not None:
+            return [func(*args, rates) for args in zip(*iterables)]
+        return list(map(func, *iterables))
+    # with profiling on every worker profiles its calls, the stages are merged under the caller's stage
+    task = instrument.wrap(partial(_with_worker_rates, func) if rates is not None else func)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(rates,)) as pool:
+        results = list(pool.map(task, *iterables))
+    return [instrument.merge(res) for res in results] if instrument.enabled() else results
+
+
+def calc_year(report, dump_dir, full, rates):
+    """Разбор, проверка (validate) и расчет года: (сделки, YearResult, []). Если в отчете есть валюты без курсов,
+    вместо YearResult возвращаются разделы с найденными проблемами и список этих валют, расчет заканчивает year_result.
+    Если отчет не прошел проверку схемы, год не рассчитывается: в YearResult только validation_res.
+    Без full читаются только сделки (год нужен только для истории лотов), вместо YearResult - None"""
+    year = report[0]
+    with stage("calc_year", year):
+        if not full:
+            print(f"Из отчета за {year} год нужны только сделки")
+        with stage("split_report"):
+            sections = split_report(report, dump_dir, None if full else ["Trades"])
+        if full:
+            with stage("validate"):
+                problems = check_schema(year, sections)
+            if problems:
+                print(f"Отчет за {year} год не подходит для расчета: нет нужных столбцов или в них не числа")
+                # the lots history still needs the year's trades if the Trades section itself is fine
+                trades = None
+                if "Trades" in sections and all(section != "Trades" for _, _, section, *_ in problems):
+                    with stage("load_data"):
+                        trades = load_data(year, {"Trades": sections["Trades"]})[1]
+                return trades, YearResult(year, validation_res=problems_frame(problems)), []
+        with stage("load_data"):
+            data = load_data(year, sections)
+        if not full:
+            return data[1], None, []
+        with stage("validate"):
+            problems = check_sections(year, sections, data[1])
+        del sections
+        missing = rates.missing(section_currencies(data))
+        if missing:
+            return data[1], (data, problems), missing
+        res = year_result(year, data, problems, rates)
+    return data[1], res, []
+
+
+def year_result(year, data, problems, rates):
+    """YearResult года по разделам load_data; проблемы проверки отчета и курсов - в validation_res"""
+    cashflow, trades, comissions, div, div_tax, div_accurals, interests = data
+    with stage("validate"):
+        problems = problems_frame(problems + check_rates(year, data, rates) + check_div_tax(year, div, div_tax))
+    with stage("year_results"):
+        try:
+            res = YearResult(year, year_results(year, cashflow, comissions, div, div_tax, div_accurals, interests, rates))
+        except ValueError:
+            # missing rates and the like stop the calculation, the problems found explain why
+            print_problems(year, problems)
+            raise
+    res["validation_res"] = problems
+    return res
+
+
+def select_years(yearReports, years=None, from_year=None):
+    """Года для расчета по --years и --from: множество, None - все отчеты"""
+    if years is None and from_year is None:
+        return None
+    selected = set(years) if years is not None else {year for year, _ in yearReports}
+    if from_year is not None:
+        selected = {year for year in selected if year >= from_year}
+    return selected
+
+
+class TaxReportEngine:
+    """Расчет пояснительной записки по годовым отчетам IB.
+
+    statements - словарь {год: путь к отчету}, список пар (год, путь) или путей к отчетам (год - по report_year),
+    start_date - дата открытия счета ДД.ММ.ГГГГ, rates - готовые курсы CurrencyRates
+    (по умолчанию загружаются из rates_db и rates_source при первом расчете),
+    checkpoint_dir - папка состояний открытых лотов (None - не сохранять),
+    dump_dir - папка для отладочного сохранения разделов отчетов (расчет тогда идет без кэша),
+    cache_dir - папка кэша результатов по годам (None - не использовать),
+    years - года, которые нужно рассчитать (None - все); из отчетов за предыдущие года читаются только сделки,
+    отчеты за следующие не читаются.
+    """
+
+    def __init__(self, statements, start_date, rates=None, jobs=1, incremental=False, checkpoint_dir=None,
+                 rates_db=ratesDbName, rates_source=ratesSource, dump_dir=None, template=templateName, cache_dir=None,
+                 years=None):
+        if isinstance(statements, dict):
+            statements = statements.items()
+        self.yearReports = sorted(
+            report if isinstance(report, tuple) else (report_year(report), report)
+            for report in statements
+        )
+        self.start_date = start_date
+        self.rates = rates
+        self.jobs = jobs if jobs > 0 else os.cpu_count()
+        self.incremental = incremental
+        self.checkpoint_dir = checkpoint_dir
+        self.rates_db = rates_db
+        self.rates_source = rates_source
+        self.dump_dir = dump_dir
+        self.template = template
+        self.cache = ResultCache(cache_dir) if cache_dir else None
+        self.years = None if years is None else set(years)
+        # open lots and matched trade rows by year after run()
+        self.assets = {}
+        self.matched = {}
+
+    def load_rates(self, To=None, currencies=None):
+        """Курсы ЦБ по To; currencies - валюты, которых нет в уже загруженных курсах"""
+        if self.rates is None:
+            with stage("rates"):
+                self.rates = get_crs_tables(self.start_date, To, self.rates_db, self.rates_source)
+        if currencies:
+            with stage("rates"):
+                self.rates.update(get_crs_tables(self.start_date, To, self.rates_db, self.rates_source, currencies).tables)
+        return self.rates
+
+    def selected(self, year):
+        return self.years is None or year in self.years
+
+    def needed_reports(self):
+        """Отчеты за выбранные года и все предыдущие, без которых не сопоставить сделки"""
+        if self.years is None:
+            return self.yearReports
+        found = {year for year, _ in self.yearReports}
+        missing = sorted(self.years - found)
+        if missing:
+            print(f"Нет отчетов за {', '.join(map(str, missing))} {'год' if len(missing) == 1 else 'годы'}")
+        if not self.years & found:
+            return []
+        return [report for report in self.yearReports if report[0] <= max(self.years & found)]
+
+    def run(self):
+        """Расчет годов self.years (по умолчанию всех), возвращает {год: YearResult}"""
+        yearReports = self.needed_reports()
+        if len(yearReports) == 0:
+            return {}
+        digests = {year: file_digest(fname) for year, fname in yearReports}
+        assets = self.assets = {}
+        if self.incremental and self.checkpoint_dir:
+            # the selected years themselves have to be calculated, not restored
+            before = min(self.years) if self.years else None
+            checkpointYear, assets = load_checkpoint(self.checkpoint_dir, digests, before)
+            self.assets = assets
+            if checkpointYear is not None:
+                print(f"Используем сохраненное состояние сделок на конец {checkpointYear} года")
+                yearReports = [report for report in yearReports if report[0] > checkpointYear]
+                if len(yearReports) == 0:
+                    print("Новых отчетов нет")
+                    return {}
+
+        # rates are needed up to the end of the last reported year only
+        To = datetime(yearReports[-1][0], 12, 31)
+        rates = self.load_rates(To)
+
+        if self.dump_dir:
+            clear_dump_dir(self.dump_dir)
+
+        results = {}
+        self.matched = {}
+        keys = self.cache_keys(yearReports, digests, rates)
+        cached = []
+        # the leading years with unchanged inputs are taken from the cache, the rest continue from their open lots
+        for year, _ in yearReports:
+            entry = self.cache.get(keys[year]) if keys else None
+            if entry is None:
+                break
+            cached.append(year)
+            if self.selected(year):
+                results[year] = YearResult(year, entry["result"])
+                results[year].cache_key = keys[year]
+            self.matched[year] = entry["matched"]
+            assets = self.assets = restore_assets(entry["assets"])
+        if cached:
+            print(f"Результаты из кэша за годы: {', '.join(map(str, cached))}")
+            yearReports = [report for report in yearReports if report[0] not in cached]
+            if len(yearReports) == 0:
+                print_report(results)
+                return results
+
+        # years are independent up to trades matching, which needs the whole history
+        trades = {}
+        full = [self.selected(year) for year, _ in yearReports]
+        calculated = run_jobs(self.jobs, calc_year, yearReports, [self.dump_dir] * len(yearReports), full, rates=rates)
+        # currencies other than the usual ones are loaded once they are met in the statements
+        missing = sorted(set().union(*(year_missing for _, _, year_missing in calculated)))
+        if missing:
+            print(f"В отчетах есть валюты {', '.join(missing)}, загружаем их курсы")
+            rates = self.load_rates(To, missing)
+            # the keys hash the rates, the results are stored under the keys of the rates they were calculated with
+            keys = self.cache_keys(yearReports, digests, rates)
+        for report, year_full, (year_trades, year_res, year_missing) in zip(yearReports, full, calculated):
+            trades[report[0]] = year_trades
+            if year_full:
+                results[report[0]] = year_result(report[0], *year_res, rates) if year_missing else year_res
+
+        states = {}
+        positions = [lot_positions(assets)]
+
+        def on_year(year, assets, rows):
+            # open lots have to change exactly by the year's trades
+            after = lot_positions(assets)
+            if year in results and results[year].calculated():
+                with stage("validate", year):
+                    problems = check_positions(year, positions[-1], after, trades[year])
+                if problems:
+                    found = results[year]["validation_res"]
+                    results[year]["validation_res"] = pd.concat([found, problems_frame(problems)], ignore_index=True)
+            positions.append(after)
+            if keys:
+                states[year] = assets_state(assets)
+
+        calculatedTrades = proceed_trades(yearReports, trades, assets, digests, self.checkpoint_dir, on_year)
+        self.matched.update(calculatedTrades)
+        for report in yearReports:
+            year = report[0]
+            if year not in results or not results[year].calculated():
+                continue
+            with stage("trades_calc", year):
+                results[year].update(trades_calc(calculatedTrades[year], rates))
+            if keys:
+                self.cache.put(keys[year], {"result": dict(results[year]), "assets": states[year], "matched": calculatedTrades[year]})
+                results[year].cache_key = keys[year]
+        print_report(results)
+        return results
+
+    def cache_keys(self, yearReports, digests, rates):
+        """{год: ключ кэша}, пустой словарь - кэш не используется"""
+        if self.cache is None or self.dump_dir:
+            return {}
+        template_digest = file_digest(self.template)
+        return {year: year_key(year, digests, rates, self.start_date, template_digest) for year, _ in yearReports}
+
+    def write(self, results, formats=("docx",), outdir="."):
+        """Запись результатов run() в форматах formats (docx, json, csv, xlsx, parquet), возвращает имена файлов;
+        пояснительные записки формируются последними, как самый долгий этап"""
+        os.makedirs(outdir, exist_ok=True)
+        fnames = []
+        for name in formats:
+            if name != "docx":
+                with stage("write", name):
+                    fnames += sinks[name](results, outdir)
+        if "docx" in formats:
+            fnames += self.render(results, outdir)
+        return fnames
+
+    def render(self, results, outdir="."):
+        """Пояснительные записки по результатам run(), возвращает имена файлов"""
+        fnames = {}
+        for year in sorted(results):
+            key = getattr(results[year], "cache_key", None)
+            fname = os.path.join(outdir, docName.format(year=year))
+            if key and self.cache is not None and self.cache.get_file(key, fname):
+                print(f"Пояснительная записка за {year} год взята из кэша")
+                fnames[year] = fname
+        years = []
+        for year in sorted(results):
+            if not results[year].calculated():
+                print(f"Пояснительная записка за {year} год не формируется: отчет не прошел проверку")
+            elif year not in fnames:
+                years.append(year)
+        rendered = run_jobs(
+            self.jobs, create_doc, years, [results[year] for year in years], [self.start_date] * len(years),
+            [self.template] * len(years), [outdir] * len(years)
+        )
+        for year, fname in zip(years, rendered):
+            fnames[year] = fname
+            key = getattr(results[year], "cache_key", None)
+            if key and self.cache is not None:
+                self.cache.put_file(key, fname)
+        return [fnames[year] for year in sorted(fnames)]
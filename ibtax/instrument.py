@@ -0,0 +1,191 @@
+# coding: utf-8
+
+import json
+import time
+import logging
+import tracemalloc
+import contextlib
+from functools import partial
+
+log = logging.getLogger("ibtax")
+
+_profile = None
+
+
+class Profile:
+    """Время, счетчики и (при memory) пик памяти tracemalloc по стекам этапов"""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.started = time.perf_counter()
+        self.stack = []
+        # path (tuple of labels) -> record
+        self.stages = {}
+        self.counters = {}
+
+    def record(self, path):
+        if path not in self.stages:
+            self.stages[path] = {"calls": 0, "seconds": 0.0, "child_seconds": 0.0, "peak_bytes": 0, "counters": {}}
+        return self.stages[path]
+
+    def fold_peak(self):
+        # tracemalloc has one peak, so it is folded into every open stage before a reset
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self.stack:
+            frame["peak"] = max(frame["peak"], peak - frame["base"])
+        tracemalloc.reset_peak()
+        return current
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.stack:
+            counters = self.stack[-1]["counters"]
+            counters[name] = counters.get(name, 0) + value
+
+    def merge(self, stages, counters):
+        """Этапы из другого процесса добавляются под текущий стек"""
+        prefix = tuple(frame["label"] for frame in self.stack)
+        for path, values in stages:
+            if prefix and len(path) == 1:
+                self.record(prefix)["child_seconds"] += values["seconds"]
+            record = self.record(prefix + tuple(path))
+            record["calls"] += values["calls"]
+            record["seconds"] += values["seconds"]
+            record["child_seconds"] += values["child_seconds"]
+            record["peak_bytes"] = max(record["peak_bytes"], values["peak_bytes"])
+            for name, value in values["counters"].items():
+                record["counters"][name] = record["counters"].get(name, 0) + value
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def dump(self):
+        """Состояние для передачи между процессами"""
+        return [(list(path), values) for path, values in self.stages.items()], dict(self.counters)
+
+    def report(self):
+        stages = []
+        for path, values in self.stages.items():
+            stages.append({
+                "path": list(path),
+                "calls": values["calls"],
+                "seconds": round(values["seconds"], 6),
+                "self_seconds": round(max(values["seconds"] - values["child_seconds"], 0.0), 6),
+                "peak_bytes": values["peak_bytes"] if self.memory else None,
+                "counters": values["counters"],
+            })
+        totals = {}
+        for stage in stages:
+            name = stage["path"][-1].split("[")[0]
+            totals[name] = round(totals.get(name, 0.0) + stage["self_seconds"], 6)
+        return {
+            "seconds": round(time.perf_counter() - self.started, 6),
+            "memory": self.memory,
+            "counters": self.counters,
+            "self_seconds_by_stage": totals,
+            "stages": stages,
+        }
+
+    def folded(self):
+        """Строки "a;b;c N" (N - собственное время этапа в микросекундах) для flamegraph.pl и speedscope"""
+        lines = []
+        for path, values in self.stages.items():
+            micros = int(round(max(values["seconds"] - values["child_seconds"], 0.0) * 1e6))
+            if micros:
+                lines.append(f"{';'.join(label.replace(';', ',').replace(' ', '_') for label in path)} {micros}")
+        return lines
+
+
+def enable(memory=False):
+    global _profile
+    _profile = Profile(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _profile
+
+
+def disable():
+    global _profile
+    profile, _profile = _profile, None
+    if profile is not None and profile.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return profile
+
+
+def enabled():
+    return _profile is not None
+
+
+def count(name, value=1):
+    """Счетчик (строки, запросы курсов, лоты) текущего этапа и всего запуска"""
+    if _profile is not None:
+        _profile.count(name, int(value))
+
+
+def stage(name, key=None):
+    """Контекстный менеджер этапа name (key - год или клиент); без enable() ничего не делает"""
+    if _profile is None:
+        return contextlib.nullcontext()
+    return _stage(_profile, name if key is None else f"{name}[{key}]")
+
+
+@contextlib.contextmanager
+def _stage(profile, label):
+    frame = {"label": label, "counters": {}, "peak": 0, "base": 0}
+    if profile.memory:
+        frame["base"] = profile.fold_peak()
+    profile.stack.append(frame)
+    path = tuple(item["label"] for item in profile.stack)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if profile.memory:
+            profile.fold_peak()
+        profile.stack.pop()
+        record = profile.record(path)
+        record["calls"] += 1
+        record["seconds"] += seconds
+        record["peak_bytes"] = max(record["peak_bytes"], frame["peak"])
+        for key, value in frame["counters"].items():
+            record["counters"][key] = record["counters"].get(key, 0) + value
+        if profile.stack:
+            profile.record(path[:-1])["child_seconds"] += seconds
+        log.debug(
+            "%s: %.3f s%s", "/".join(path), seconds,
+            "".join(f", {key}={value}" for key, value in frame["counters"].items()),
+            extra={"stage": list(path), "seconds": seconds, "counters": frame["counters"], "peak_bytes": frame["peak"]},
+        )
+
+
+def profiled(func, memory, *args):
+    """Вызов func в процессе пула с отдельным профилем; результат и этапы возвращаются в основной процесс через merge"""
+    enable(memory)
+    try:
+        return func(*args), disable().dump()
+    finally:
+        disable()
+
+
+def wrap(func):
+    """func для пула процессов: при включенном профиле вызывается через profiled"""
+    if _profile is None:
+        return func
+    return partial(profiled, func, _profile.memory)
+
+
+def merge(result):
+    res, (stages, counters) = result
+    if _profile is not None:
+        _profile.merge(stages, counters)
+    return res
+
+
+def write_profile(profile, fname):
+    """JSON отчет в fname и свернутые стеки в fname без расширения + .folded, возвращает имена файлов"""
+    with open(fname, "w", encoding="utf8") as file:
+        json.dump(profile.report(), file, indent=2, ensure_ascii=False)
+    folded = f"{fname.rsplit('.', 1)[0] if fname.endswith('.json') else fname}.folded"
+    with open(folded, "w", encoding="utf8") as file:
+        file.write("\n".join(profile.folded()) + "\n")
+    return [fname, folded]
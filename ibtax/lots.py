@@ -0,0 +1,352 @@
+# coding: utf-8
+
+import os
+import pickle
+import hashlib
+from glob import glob
+from datetime import datetime
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from .instrument import stage, count
+
+# Состояние открытых лотов на конец каждого закрытого года
+checkpointDirName = "checkpoints"
+checkpointVersion = 4
+
+
+class Lot:
+    __slots__ = ("date", "price", "fee", "quantity", "currency", "proceeds")
+
+    def __init__(self, date, price, fee, quantity, currency, proceeds):
+        self.date = date
+        self.price = price
+        self.fee = fee
+        self.quantity = quantity
+        self.currency = currency
+        self.proceeds = proceeds
+
+
+class LotBook:
+    """FIFO очередь открытых лотов одного инструмента: все длинные (quantity > 0) или все короткие (quantity < 0).
+
+    category - Asset Category инструмента из раздела Trades, multiplier - множитель контракта по сделкам отчета
+    (None, если неизвестны)
+    """
+    __slots__ = ("lots", "category", "multiplier")
+
+    def __init__(self, category=None, multiplier=None):
+        self.lots = deque()
+        self.category = category
+        self.multiplier = multiplier
+
+    def __len__(self):
+        return len(self.lots)
+
+    def __iter__(self):
+        return iter(self.lots)
+
+    def add(self, lot):
+        self.lots.append(lot)
+
+    def copy(self):
+        book = LotBook(self.category, self.multiplier)
+        for lot in self.lots:
+            book.add(Lot(lot.date, lot.price, lot.fee, lot.quantity, lot.currency, lot.proceeds))
+        return book
+
+    def short(self):
+        return bool(self.lots) and self.lots[0].quantity < 0
+
+    def consume(self, quantity, proceeds):
+        """Списывает quantity (> 0) с начала очереди, короткие лоты - по модулю.
+
+        Возвращает списанные части лотов (date, price, fee, cnt, currency, proceeds) со знаком лота и признак того,
+        что открытых лотов хватило. Частично списанный лот остается в начале очереди с остатком
+        и выручкой закрывающей сделки proceeds.
+        """
+        lots = self.lots
+        consumed = []
+        fulfilled = False
+        while lots:
+            lot = lots[0]
+            sign = -1 if lot.quantity < 0 else 1
+            consumed.append((lot.date, lot.price, lot.fee, sign * min(sign * lot.quantity, quantity), lot.currency, lot.proceeds))
+            quantity -= sign * lot.quantity
+            fulfilled = quantity <= 0
+            if quantity < 0:
+                # -quantity items still not used from what have already been bought (or sold short), keep them at the head
+                lot.quantity = -sign * quantity
+                lot.proceeds = proceeds
+            else:
+                lots.popleft()
+            if fulfilled:
+                break
+        return consumed, fulfilled
+
+
+def file_digest(fname):
+    digest = hashlib.sha256()
+    with open(fname, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def assets_state(assets):
+    """Открытые лоты в виде, пригодном для pickle:
+    {символ: (category, multiplier, [(date, price, fee, quantity, currency, proceeds), ...])}"""
+    return {
+        key: (book.category, book.multiplier, [(lot.date, lot.price, lot.fee, lot.quantity, lot.currency, lot.proceeds) for lot in book])
+        for key, book in assets.items() if len(book)
+    }
+
+
+def restore_assets(state):
+    assets = {}
+    for key, (category, contract, lots) in state.items():
+        assets[key] = LotBook(category, contract)
+        for lot in lots:
+            assets[key].add(Lot(*lot))
+    return assets
+
+
+def save_checkpoint(checkpoint_dir, year, assets, digests):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    state = {
+        "version": checkpointVersion,
+        "year": year,
+        "digests": {y: digest for y, digest in digests.items() if y <= year},
+        "assets": assets_state(assets),
+    }
+    fname = os.path.join(checkpoint_dir, f"{year}.pkl")
+    with open(fname + ".tmp", "wb") as file:
+        pickle.dump(state, file)
+    os.replace(fname + ".tmp", fname)
+
+
+def load_checkpoint(checkpoint_dir, digests, before=None):
+    """Последнее сохраненное состояние, для которого не изменился ни один отчет за предыдущие года.
+
+    Отчеты, которых уже нет в папке, считаются неизменными. Состояния на конец года позже последнего проверенного отчета
+    и, если задан before, на конец года before и позже не используются.
+    """
+    fnames = glob(os.path.join(checkpoint_dir, "*.pkl"))
+    for fname in sorted(fnames, key=lambda f: int(os.path.basename(f).split('.')[0]), reverse=True):
+        with open(fname, "rb") as file:
+            state = pickle.load(file)
+        if state.get("version") != checkpointVersion:
+            continue
+        year = state["year"]
+        if (before is not None and year >= before) or not digests or year > max(digests):
+            continue
+        changed = [y for y, digest in digests.items() if y <= year and state["digests"].get(y) != digest]
+        if changed:
+            print(f"Отчет за {changed[0]} год изменился, состояние на конец {year} года не используется")
+            continue
+        return year, restore_assets(state["assets"])
+    return None, {}
+
+
+tradeColumns = ['ticker', 'der_type', 'date', 'price', 'fee', 'cnt', 'currency', 'proceeds']
+lotFields = ['date', 'price', 'fee', 'cnt', 'currency', 'proceeds']
+# Цена опциона в отчете указана за одну акцию
+optionMultiplier = 100
+# Тип ПФИ по Asset Category отчета
+derivativeTypes = {"Equity and Index Options": 'Опцион', "Options On Futures": 'Опцион', "Futures": 'Фьючерс'}
+
+
+def der_type(key, category=None):
+    """Тип ПФИ ('' - ценная бумага); без категории отчета опционом считается символ с пробелом, как AAPL 200117C00300000"""
+    if not isinstance(category, str):
+        return 'Опцион' if ' ' in key else ''
+    return derivativeTypes.get(category, '')
+
+
+def multiplier(key, category=None):
+    """Число единиц базового актива в одном контракте, на которое умножается цена, если его нет в сделках отчета:
+    1 для ЦБ, optionMultiplier для опционов на акции и индексы; None - у фьючерсов и опционов на них он у каждого
+    контракта свой"""
+    kind = der_type(key, category)
+    if kind == '':
+        return 1
+    if kind == 'Опцион' and category != "Options On Futures":
+        return optionMultiplier
+    return None
+
+
+def book_multiplier(key, book):
+    """Множитель контракта по сделкам отчета, иначе multiplier(); None - неизвестен"""
+    return book.multiplier if book.multiplier is not None else multiplier(key, book.category)
+
+
+def trades_multiplier(val):
+    """Множитель контракта ПФИ по сделкам отчета: |proceeds| / |quantity * price|; None - ни в одной сделке нет цены и выручки"""
+    notional = np.abs(val.quantity.to_numpy(dtype=float) * val.price.to_numpy(dtype=float))
+    proceeds = np.abs(val.proceeds.to_numpy(dtype=float))
+    known = (notional > 0) & (proceeds > 0)
+    if not known.any():
+        return None
+    ratio = float(np.median(proceeds[known] / notional[known]))
+    # prices in the statement are rounded, contract multipliers are whole or fractions like 0.1
+    return float(round(ratio)) if ratio >= 1 else float(f"{ratio:.2g}")
+
+
+def open_lots(assets):
+    """Открытые лоты всех инструментов одной таблицей (столбцы tradeColumns, category и multiplier - NaN, если неизвестен)
+    в порядке FIFO"""
+    rows = [
+        (key, der_type(key, book.category), lot.date, lot.price, lot.fee, lot.quantity, lot.currency, lot.proceeds)
+        for key, book in assets.items() for lot in book
+    ]
+    lots = pd.DataFrame(rows, columns=tradeColumns)
+    lots["category"] = [book.category for book in assets.values() for _ in book]
+    contracts = {key: book_multiplier(key, book) for key, book in assets.items()}
+    lots["multiplier"] = np.array([contracts[key] for key, book in assets.items() for _ in book], dtype=float)
+    lots["date"] = pd.to_datetime(lots.date)
+    return lots
+
+
+def match_lots_loop(key, book, val):
+    """Сопоставление по LotBook сделка за сделкой: продажа без открытых лотов открывает короткую позицию,
+    покупка ее закрывает; сделка больше позиции закрывает ее и открывает обратную на остаток"""
+    matched = {name: [] for name in lotFields}
+    for date, price, fee, quantity, currency, proceeds in zip(val.date, val.price, val.fee, val.quantity, val.currency, val.proceeds):
+        if quantity != 0 and (not len(book) or book.short() == (quantity < 0)):
+            book.add(Lot(date, price, fee, quantity, currency, proceeds))
+            continue
+        if not len(book):
+            continue
+        consumed, fulfilled = book.consume(abs(quantity), proceeds)
+        closing = (date, price, fee, quantity, currency, proceeds)
+        if not fulfilled:
+            # the rest of the trade opens the opposite position, fee and proceeds are split by quantity
+            closed = -sum(piece[3] for piece in consumed)
+            share = closed / quantity
+            closing = (date, price, fee * share, closed, currency, proceeds * share)
+            book.add(Lot(date, price, fee - closing[2], quantity - closed, currency, proceeds - closing[5]))
+            print(f"{'Продали' if quantity < 0 else 'Купили'} {key} больше открытой позиции, на остаток открыта "
+                  f"{'короткая' if quantity < 0 else 'длинная'} позиция")
+        count("lots_consumed", len(consumed))
+        # The trade closed the respective amount of lots, show this in report
+        for piece in consumed + [closing]:
+            for name, value in zip(lotFields, piece):
+                matched[name].append(value)
+    return matched
+
+
+def match_lots(key, book, val):
+    """Сопоставление продаж с открытыми лотами по FIFO для одного инструмента.
+
+    Продажи разбиваются на части по накопленным суммам количества покупок и продаж без цикла по сделкам.
+    Инструменты с короткой позицией, продажей больше открытой позиции, нулевым или дробным количеством
+    обрабатываются через match_lots_loop.
+    """
+    quantity = val.quantity.values
+    lots = list(book)
+    if book.short():
+        return match_lots_loop(key, book, val)
+    lot_quantity = np.array([lot.quantity for lot in lots] + list(quantity[quantity > 0]))
+    if (
+        not np.issubdtype(quantity.dtype, np.number)
+        or not np.issubdtype(lot_quantity.dtype, np.number)
+        or (quantity == 0).any()
+        or (lot_quantity != np.round(lot_quantity)).any()
+        or (quantity != np.round(quantity)).any()
+    ):
+        return match_lots_loop(key, book, val)
+
+    is_buy = quantity > 0
+    sell_quantity = -quantity[~is_buy].astype(np.int64)
+    sold = np.cumsum(sell_quantity)
+    bought = np.cumsum(lot_quantity.astype(np.int64))
+    bought_before_sell = (bought[len(lots) - 1] if len(lots) else 0) + np.cumsum(np.where(is_buy, quantity, 0).astype(np.int64))[~is_buy]
+    if (sold > bought_before_sell).any():
+        return match_lots_loop(key, book, val)
+
+    lot_date = np.concatenate([pd.to_datetime([lot.date for lot in lots]).values, val.date.values[is_buy]]) if len(lots) else val.date.values[is_buy]
+    lot_price = np.concatenate([[lot.price for lot in lots], val.price.values[is_buy]])
+    lot_fee = np.concatenate([[lot.fee for lot in lots], val.fee.values[is_buy]])
+    lot_currency = np.concatenate([np.array([lot.currency for lot in lots], dtype=object), val.currency.values[is_buy]])
+    lot_proceeds = np.concatenate([[lot.proceeds for lot in lots], val.proceeds.values[is_buy]])
+    sell_proceeds = val.proceeds.values[~is_buy]
+
+    total = sold[-1] if len(sold) else 0
+    # every piece (start, end] lies inside one lot and one sell
+    ends = np.unique(np.concatenate([bought[bought < total], sold]))
+    starts = np.concatenate([[0], ends[:-1]])
+    lot_idx = np.searchsorted(bought, ends, side='left')
+    sell_idx = np.searchsorted(sold, ends, side='left')
+    lot_start = bought - lot_quantity
+    # a lot split by the previous sell carries that sale's proceeds, as LotBook.consume does
+    first_piece = starts == lot_start[lot_idx]
+    piece_proceeds = np.where(first_piece, lot_proceeds[lot_idx], sell_proceeds[np.maximum(sell_idx - 1, 0)])
+
+    count("lots_consumed", len(lot_idx))
+    cnt_dtype = np.result_type(quantity.dtype, lot_quantity.dtype)
+    sells = np.arange(len(sold))
+    order = np.argsort(np.concatenate([sell_idx * 2, sells * 2 + 1]), kind="stable")
+    matched = {
+        'date': np.concatenate([lot_date[lot_idx], val.date.values[~is_buy]])[order],
+        'price': np.concatenate([lot_price[lot_idx], val.price.values[~is_buy]])[order],
+        'fee': np.concatenate([lot_fee[lot_idx], val.fee.values[~is_buy]])[order],
+        'cnt': np.concatenate([(ends - starts).astype(cnt_dtype), quantity[~is_buy].astype(cnt_dtype)])[order],
+        'currency': np.concatenate([lot_currency[lot_idx], val.currency.values[~is_buy]])[order],
+        'proceeds': np.concatenate([piece_proceeds, sell_proceeds])[order],
+    }
+
+    rest = np.searchsorted(bought, total, side='right')
+    book.lots = deque(
+        Lot(date, price, fee, quantity, currency, proceeds)
+        for date, price, fee, quantity, currency, proceeds in zip(
+            pd.to_datetime(lot_date[rest:]), lot_price[rest:], lot_fee[rest:],
+            lot_quantity[rest:], lot_currency[rest:], lot_proceeds[rest:]
+        )
+    )
+    if len(book) and lot_start[rest] < total:
+        head = book.lots[0]
+        head.quantity = (bought[rest] - total).astype(lot_quantity.dtype)
+        head.proceeds = sell_proceeds[-1]
+    return matched
+
+
+def proceed_trades(yearReports, trades, assets=None, digests=None, checkpoint_dir=None, on_year=None):
+    """Сопоставление сделок всех годов по FIFO, возвращает {год: строки сделок}; assets - открытые лоты на начало,
+    дополняются на месте; on_year(year, assets, rows) вызывается после каждого года"""
+    assets = {} if assets is None else assets
+    rows = {}
+    for report in yearReports:
+        year = report[0]
+        with stage("proceed_trades", year):
+            print(f"Расчет сделок за {year} год...")
+            matched = {name: [] for name in tradeColumns}
+            if trades[year] is None:
+                print(f"За {year} нет сделок")
+            else:
+                for key, val in trades[year].groupby("symbol", observed=True):
+                    category = val["asset category"].iloc[0] if "asset category" in val else None
+                    if key not in assets:
+                        assets[key] = LotBook()
+                    if isinstance(category, str):
+                        assets[key].category = category
+                    # securities always have 1, derivatives take theirs from the statement
+                    if assets[key].multiplier is None and der_type(key, category) != '':
+                        assets[key].multiplier = trades_multiplier(val)
+                    symbol_matched = match_lots(key, assets[key], val)
+                    size = len(symbol_matched['cnt'])
+                    matched['ticker'].append(np.full(size, key, dtype=object))
+                    matched['der_type'].append(np.full(size, der_type(key, category), dtype=object))
+                    for name in lotFields:
+                        matched[name].append(np.asarray(symbol_matched[name]))
+            rows[year] = pd.DataFrame(
+                {name: np.concatenate(matched[name]) for name in tradeColumns} if len(matched['cnt']) else [],
+                columns=tradeColumns
+            )
+            count("trade_rows", len(rows[year]))
+        if checkpoint_dir and digests is not None and year < datetime.today().year:
+            save_checkpoint(checkpoint_dir, year, assets, digests)
+        if on_year is not None:
+            on_year(year, assets, rows[year])
+    return rows
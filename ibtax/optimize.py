@@ -0,0 +1,119 @@
+# coding: utf-8
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .lots import open_lots
+from .instrument import stage, count
+
+# Ставка НДФЛ, как в calc
+taxRate = 0.13
+# Доход года, который уменьшают убытки ЦБ (der_type '') и ПФИ
+incomeFields = {'cb': 'income_rub_sum_cb', 'pfi': 'income_rub_sum_pfi'}
+harvestColumns = ['ticker', 'der_type', 'cnt', 'price', 'currency', 'loss_rub', 'tax_saved_rub']
+
+
+class TaxLossHarvester:
+    """Подбор продаж открытых лотов с убытком, уменьшающих налог года.
+
+    Стоимость лотов в рублях по курсу ЦБ на дату покупки считается один раз, suggest() для других цен
+    и дохода только пересчитывает столбцы. Продажа списывает лоты по FIFO, как proceed_trades;
+    комиссия продажи не учитывается. Лоты с неизвестным множителем контракта (фьючерсы без сделок в отчете) не учитываются.
+    """
+
+    def __init__(self, assets, rates):
+        self.rates = rates
+        lots = open_lots(assets)
+        lots = lots[lots.cnt > 0]
+        unknown = lots.multiplier.isna()
+        if unknown.any():
+            print(f"Неизвестен множитель контракта {', '.join(pd.unique(lots.ticker[unknown]))}, эти лоты не учитываются")
+        lots = lots[~unknown].reset_index(drop=True)
+        # the buy fee is negative in the statement and adds to the cost
+        lots["basis_rub"] = (lots.cnt * lots.price * lots.multiplier - lots.fee) * rates.get_currencies(lots.date, lots.currency)
+        self.lots = lots
+
+    def tickers(self):
+        return list(pd.unique(self.lots.ticker))
+
+    def suggest(self, prices, income, date=None):
+        """prices - {тикер: цена}, income - {'cb': доход по ЦБ, 'pfi': по ПФИ} в рублях, date - дата продажи (по умолчанию сегодня).
+
+        Возвращает таблицу harvestColumns: сколько продать каждого тикера, убыток и уменьшение налога.
+        Тикеры без цены пропускаются.
+        """
+        date = pd.Timestamp.today().normalize() if date is None else pd.Timestamp(date)
+        price = self.lots.ticker.map(prices).to_numpy(dtype=float)
+        lots = self.lots[~np.isnan(price)].reset_index(drop=True)
+        price = price[~np.isnan(price)]
+        count("harvest_lots", len(lots))
+        rate = self.rates.get_currencies(np.full(len(lots), date.to_datetime64()), lots.currency)
+        # gain of selling one unit of the lot now, and of selling the FIFO prefix up to the lot
+        unit_gain = price * lots.multiplier.to_numpy() * rate - lots.basis_rub.to_numpy() / lots.cnt.to_numpy()
+        cum_gain = pd.Series(unit_gain * lots.cnt.to_numpy()).groupby(lots.ticker.to_numpy()).cumsum().to_numpy()
+        cum_cnt = lots.cnt.groupby(lots.ticker).cumsum().to_numpy()
+        # lots of a ticker are contiguous in open_lots
+        position = lots.groupby("ticker").cumcount().to_numpy()
+
+        suggestions = []
+        for kind in incomeFields:
+            need = max(float(income.get(kind) or 0), 0)
+            mask = ((lots.der_type != '') == (kind == 'pfi')).to_numpy()
+            if need <= 0 or not mask.any():
+                continue
+            # deepest loss of every ticker over its FIFO prefixes, the largest first
+            best = pd.Series(cum_gain[mask], index=np.flatnonzero(mask)).groupby(lots.ticker.to_numpy()[mask]).idxmin()
+            best = best[cum_gain[best.to_numpy()] < 0]
+            for ticker, last in sorted(best.items(), key=lambda item: cum_gain[item[1]]):
+                if need <= 0:
+                    break
+                first = last - position[last]
+                cnt, loss = cum_cnt[last], -cum_gain[last]
+                if loss > need:
+                    cnt, loss = partial_sale(cum_gain[first:last + 1], cum_cnt[first:last + 1], unit_gain[first:last + 1], need)
+                suggestions.append((ticker, lots.der_type[last], cnt, prices[ticker], lots.currency[last], round(loss, 2), round(min(loss, need) * taxRate, 2)))
+                need -= loss
+        return pd.DataFrame(suggestions, columns=harvestColumns)
+
+
+def partial_sale(cum_gain, cum_cnt, unit_gain, need):
+    """Наименьшее целое количество от начала FIFO, убыток которого не меньше need, и этот убыток"""
+    i = int(np.argmax(cum_gain <= -need))
+    prev_gain = cum_gain[i - 1] if i else 0.0
+    prev_cnt = cum_cnt[i - 1] if i else 0
+    lot_cnt = cum_cnt[i] - prev_cnt
+    units = min(np.ceil((need + prev_gain) / -unit_gain[i]), lot_cnt)
+    return prev_cnt + units, -(prev_gain + units * unit_gain[i])
+
+
+def year_income(res):
+    return {kind: (res.get(field) or 0) if res is not None else 0 for kind, field in incomeFields.items()}
+
+
+def harvest_report(engine, results, prices, year=None):
+    """Предложения по продажам для налоговой оптимизации по открытым лотам engine после run();
+    prices - PriceService. Продажи считаются сделанными сегодня, доход - из результата за год year
+    (по умолчанию последний рассчитанный)"""
+    with stage("optimize"):
+        if year is None:
+            calculated = [y for y, res in results.items() if res.calculated()]
+            year = max(calculated) if calculated else datetime.today().year
+        if year not in results or not results[year].calculated():
+            print(f"Нет результата расчета за {year} год, доход считается равным 0 и уменьшать нечего")
+        else:
+            print(f"Продажи подбираются для дохода за {year} год")
+        harvester = TaxLossHarvester(engine.assets, engine.load_rates())
+        current = prices.get_prices(harvester.tickers())
+        missing = [ticker for ticker in harvester.tickers() if ticker not in current]
+        if missing:
+            print(f"Нет текущих цен для {', '.join(missing)}, они не учитываются")
+        suggestions = harvester.suggest(current, year_income(results.get(year)))
+    if not len(suggestions):
+        print("Продаж, уменьшающих налог, не найдено")
+        return suggestions
+    print("Для уменьшения налога можно продать:")
+    print(suggestions.to_string(index=False))
+    print(f"Налог уменьшится на {suggestions.tax_saved_rub.sum():.2f} Rub")
+    return suggestions
@@ -0,0 +1,148 @@
+# coding: utf-8
+
+import time
+import sqlite3
+from collections import OrderedDict
+
+from .instrument import count
+
+# Цены последней сессии: хранилище, время жизни (секунды) и число тикеров в кэше
+pricesDbName = "prices.db"
+pricesTtl = 15 * 60
+pricesCacheSize = 2048
+
+
+def yfinance_prices(tickers):
+    """Медианы цен закрытия за последний день по всем тикерам одним запросом yf.download"""
+    import yfinance as yf
+
+    tickers = list(tickers)
+    data = yf.download(tickers, period="1d", progress=False, auto_adjust=False, group_by="column")
+    if data is None or not len(data):
+        return {}
+    close = data["Close"]
+    if close.ndim == 1:
+        close = close.to_frame(tickers[0])
+    medians = close.median()
+    return {ticker: float(medians[ticker]) for ticker in tickers if ticker in medians and medians[ticker] == medians[ticker]}
+
+
+class StubPrices:
+    """Провайдер цен из словаря {тикер: цена} для работы без сети; calls - список запросов"""
+
+    def __init__(self, prices):
+        self.prices = dict(prices)
+        self.calls = []
+
+    def __call__(self, tickers):
+        tickers = list(tickers)
+        self.calls.append(tickers)
+        return {ticker: float(self.prices[ticker]) for ticker in tickers if ticker in self.prices}
+
+
+class PriceService:
+    """Текущие цены тикеров: все недостающие запрашиваются у provider одним вызовом,
+    результаты хранятся в памяти и в db_name (None - только в памяти) ttl секунд,
+    при переполнении max_size вытесняются давно не использованные
+    """
+
+    def __init__(self, provider=yfinance_prices, db_name=pricesDbName, ttl=pricesTtl, max_size=pricesCacheSize, clock=time.time):
+        self.provider = provider
+        self.db_name = db_name
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        # ticker -> (price, fetched), the most recently used last
+        self.memory = OrderedDict()
+        self.con = None
+
+    def connect(self):
+        if self.con is None and self.db_name:
+            self.con = sqlite3.connect(self.db_name)
+            self.con.execute("CREATE TABLE IF NOT EXISTS prices (ticker TEXT PRIMARY KEY, price REAL, fetched REAL, used REAL)")
+        return self.con
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+            self.con = None
+
+    def remember(self, ticker, price, fetched):
+        self.memory[ticker] = (price, fetched)
+        self.memory.move_to_end(ticker)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def load_stored(self, tickers, now):
+        con = self.connect()
+        if con is None or not tickers:
+            return {}
+        found = {}
+        for start in range(0, len(tickers), 500):
+            chunk = tickers[start:start + 500]
+            rows = con.execute(
+                f"SELECT ticker, price, fetched FROM prices WHERE fetched > ? AND ticker IN ({','.join('?' * len(chunk))})",
+                [now - self.ttl, *chunk]
+            ).fetchall()
+            found.update({ticker: (price, fetched) for ticker, price, fetched in rows})
+        con.executemany("UPDATE prices SET used = ? WHERE ticker = ?", [(now, ticker) for ticker in found])
+        con.commit()
+        return found
+
+    def store(self, prices, now):
+        con = self.connect()
+        if con is None or not prices:
+            return
+        con.executemany(
+            "INSERT OR REPLACE INTO prices (ticker, price, fetched, used) VALUES (?, ?, ?, ?)",
+            [(ticker, price, now, now) for ticker, price in prices.items()]
+        )
+        # least recently used tickers above max_size and expired ones are dropped
+        con.execute("DELETE FROM prices WHERE fetched <= ?", (now - self.ttl,))
+        con.execute(
+            "DELETE FROM prices WHERE ticker NOT IN (SELECT ticker FROM prices ORDER BY used DESC LIMIT ?)", (self.max_size,)
+        )
+        con.commit()
+
+    def get_prices(self, tickers):
+        """{тикер: цена}; тикеров без цены у провайдера в результате нет"""
+        now = self.clock()
+        prices = {}
+        missing = []
+        for ticker in dict.fromkeys(tickers):
+            cached = self.memory.get(ticker)
+            if cached is not None and cached[1] > now - self.ttl:
+                self.memory.move_to_end(ticker)
+                prices[ticker] = cached[0]
+            else:
+                missing.append(ticker)
+        for ticker, (price, fetched) in self.load_stored(missing, now).items():
+            self.remember(ticker, price, fetched)
+            prices[ticker] = price
+        missing = [ticker for ticker in missing if ticker not in prices]
+        count("price_hits", len(prices))
+        if missing:
+            count("price_requests")
+            count("price_tickers", len(missing))
+            fetched = self.provider(missing)
+            for ticker, price in fetched.items():
+                self.remember(ticker, price, now)
+            self.store(fetched, now)
+            prices.update(fetched)
+        return prices
+
+    def get_price(self, ticker):
+        price = self.get_prices([ticker]).get(ticker)
+        if price is None:
+            raise ValueError(f"Нет цены {ticker}!")
+        return price
+
+
+_service = None
+
+
+def get_ticker_price(ticker: str):
+    global _service
+    if _service is None:
+        _service = PriceService()
+    return _service.get_price(ticker)
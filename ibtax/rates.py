@@ -0,0 +1,259 @@
+# coding: utf-8
+
+import io
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .instrument import count
+
+# Валюты, курсы которых загружаются всегда; коды остальных берутся из справочника ЦБ РФ
+currencies = {
+    "RUB": [],
+    "USD": ["01235", "RUB=X"],
+    "EUR": ["01239", "EURRUB=X"],
+}
+
+ratesDbName = "rates.db"
+# Адрес сервиса ЦБ РФ или папка с таблицами курсов {currency}.xlsx в формате выгрузки ЦБ
+ratesSource = "https://cbr.ru"
+# Справочник валют ЦБ РФ: ISO код и внутренний код ParentCode
+codesPath = "/scripts/XML_valFull.asp"
+# Загрузка курсов: потоков (и соединений), таймауты соединения и ответа в секундах,
+# повторов после обрыва, таймаута или ответа retryStatuses с паузой downloadBackoff * 2^попытка
+downloadJobs = 8
+downloadTimeout = (5, 30)
+downloadRetries = 3
+downloadBackoff = 0.5
+retryStatuses = {429, 500, 502, 503, 504}
+
+_codes = {}
+_codes_lock = threading.Lock()
+
+
+class CurrencyRates:
+    """Курсы ЦБ РФ, отсортированные по дате, для поиска курса сразу по целым столбцам"""
+
+    def __init__(self, tables):
+        self.tables = {}
+        self.index = {}
+        self.update(tables)
+
+    def update(self, tables):
+        """Добавляет таблицы курсов {валюта: DataFrame date, val, nominal}"""
+        for currency, table in tables.items():
+            self.tables[currency] = table
+            # stable sort keeps the first of duplicated dates, as the former idxmax scan did
+            table = table.sort_values("date", kind="stable").drop_duplicates("date")
+            vals = table.val.values.astype(float)
+            if "nominal" in table:
+                # CBR quotes some currencies per 10 or 100 units
+                vals = vals / table.nominal.values
+            self.index[currency] = (table.date.values.astype("datetime64[ns]"), vals)
+
+    def missing(self, curs):
+        """Валюты из curs, курсов которых нет"""
+        return sorted(set(curs) - set(self.index) - {"RUB"})
+
+    def get_currencies(self, dates, curs):
+        dates = np.asarray(pd.to_datetime(dates), dtype="datetime64[ns]")
+        curs = np.asarray(curs, dtype=object)
+        count("fx_lookups", len(dates))
+        res = np.ones(len(dates))
+        only_rub = True
+        for cur in pd.unique(curs):
+            if cur == "RUB":
+                continue
+            if cur not in self.index:
+                raise ValueError(f"Нет курсов валюты {cur}!")
+            only_rub = False
+            index_dates, vals = self.index[cur]
+            mask = curs == cur
+            # latest rate on or before the date
+            pos = np.searchsorted(index_dates, dates[mask], side="right") - 1
+            if (pos < 0).any():
+                raise ValueError(f"Нет курса {cur} на дату {pd.Timestamp(dates[mask][pos < 0][0]).date()}!")
+            res[mask] = vals[pos]
+        return res.astype(int) if only_rub else res
+
+    def get_currency(self, date, cur):
+        return self.get_currencies([date], [cur])[0].item()
+
+    def digest(self, To=None):
+        """Отпечаток курсов по дату To включительно: другие курсы на результат расчета до To не влияют"""
+        digest = hashlib.sha256()
+        for currency in sorted(self.index):
+            dates, vals = self.index[currency]
+            end = len(dates) if To is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(To)), side="right")
+            digest.update(currency.encode())
+            digest.update(dates[:end].tobytes())
+            digest.update(vals[:end].tobytes())
+        return digest.hexdigest()
+
+
+def rates_session(jobs=downloadJobs):
+    """requests.Session с пулом на jobs соединений, общий для потоков загрузки"""
+    import requests
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch(session, url, retries=None, backoff=None, timeout=None):
+    """GET с таймаутом; после обрыва соединения, таймаута и ответов retryStatuses запрос повторяется
+    (по умолчанию downloadRetries раз, downloadBackoff, downloadTimeout)"""
+    import requests
+
+    retries = downloadRetries if retries is None else retries
+    backoff = downloadBackoff if backoff is None else backoff
+    timeout = downloadTimeout if timeout is None else timeout
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, timeout=timeout)
+            if response.status_code not in retryStatuses or attempt == retries:
+                response.raise_for_status()
+                return response
+            error = f"ответ {response.status_code}"
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            error = type(e).__name__
+        delay = backoff * 2 ** attempt
+        print(f"Запрос {url.split('?')[0]} не удался ({error}), повтор через {delay:g} с")
+        time.sleep(delay)
+
+
+def currency_code(currency, source=ratesSource, session=None):
+    """Код валюты ЦБ РФ без R: из currencies или из справочника ЦБ; для папки с таблицами не нужен"""
+    if currency in currencies:
+        return currencies[currency][0]
+    if not source.startswith("http"):
+        return None
+    with _codes_lock:
+        if source not in _codes:
+            from xml.etree import ElementTree
+
+            response = fetch(session or rates_session(1), source + codesPath)
+            _codes[source] = {
+                item.findtext("ISO_Char_Code"): item.findtext("ParentCode").strip()[1:]
+                for item in ElementTree.fromstring(response.content).iter("Item") if item.findtext("ISO_Char_Code")
+            }
+    if currency not in _codes[source]:
+        raise ValueError(f"Валюты {currency} нет в справочнике ЦБ РФ!")
+    return _codes[source][currency]
+
+
+def download_rates(currency, code, From, To, source=ratesSource, session=None):
+    Format1 = "%d.%m.%Y"
+    Format2 = "%m.%d.%Y"
+    if not source.startswith("http"):
+        df = pd.read_excel(os.path.join(source, f"{currency}.xlsx"))
+    else:
+        url = f"{source}/Queries/UniDbQuery/DownloadExcel/98956?Posted=True&mode=1&VAL_NM_RQ=R{code}&From="
+        url += f"{From.strftime(Format1)}&To={To.strftime(Format1)}"
+        url += f"&FromDate={From.strftime(Format2).replace('.', '%2F')}&ToDate={To.strftime(Format2).replace('.', '%2F')}"
+        response = fetch(session or rates_session(1), url)
+        df = pd.read_excel(io.BytesIO(response.content))
+    df = df.rename(columns={"data": "date", "curs": "val"})
+    df.date = pd.to_datetime(df.date)
+    if "nominal" not in df:
+        df["nominal"] = 1
+    df = df[["date", "val", "nominal"]]
+    return df[(df.date >= From) & (df.date <= To)]
+
+
+def download_tables(starts, To, source=ratesSource, jobs=downloadJobs):
+    """Таблицы курсов {валюта: DataFrame} с дат starts {валюта: дата} по To, в jobs потоков с общим пулом соединений;
+    вместо таблицы валюты, которую загрузить не удалось, - исключение"""
+    if not starts:
+        return {}
+    session = rates_session(jobs) if source.startswith("http") else None
+
+    def download(currency):
+        try:
+            return download_rates(currency, currency_code(currency, source, session), starts[currency], To, source, session)
+        except Exception as e:  # the caller decides whether the stored table is enough
+            return e
+
+    try:
+        with ThreadPoolExecutor(max_workers=min(jobs, len(starts))) as pool:
+            return dict(zip(starts, pool.map(download, starts)))
+    finally:
+        if session is not None:
+            session.close()
+
+
+def load_stored_rates(con, currency):
+    df = pd.read_sql_query("SELECT date, val, nominal FROM rates WHERE currency = ? ORDER BY date", con, params=(currency,))
+    df.date = pd.to_datetime(df.date)
+    row = con.execute("SELECT date_from, date_to FROM fetched WHERE currency = ?", (currency,)).fetchone()
+    fetched = (datetime.strptime(row[0], "%Y-%m-%d"), datetime.strptime(row[1], "%Y-%m-%d")) if row else None
+    return df, fetched
+
+
+def store_rates(con, currency, df, From, To):
+    con.executemany(
+        "INSERT OR REPLACE INTO rates (currency, date, val, nominal) VALUES (?, ?, ?, ?)",
+        [(currency, date.strftime("%Y-%m-%d"), float(val), int(nominal)) for date, val, nominal in zip(df.date, df.val, df.nominal)]
+    )
+    con.execute(
+        "INSERT OR REPLACE INTO fetched (currency, date_from, date_to) VALUES (?, ?, ?)",
+        (currency, From.strftime("%Y-%m-%d"), To.strftime("%Y-%m-%d"))
+    )
+    con.commit()
+
+
+def get_crs_tables(start_date, To=None, db_name=ratesDbName, source=ratesSource, names=None, jobs=downloadJobs):
+    """Таблицы курсов валют names с даты start_date (ДД.ММ.ГГГГ) по To из db_name, недостающие даты запрашиваются у source
+    параллельно в jobs потоков.
+
+    По умолчанию загружаются валюты из currencies и все, курсы которых уже есть в db_name.
+    """
+    From = datetime.strptime(start_date, "%d.%m.%Y")
+    To = min(To or datetime.today(), datetime.today()).replace(hour=0, minute=0, second=0, microsecond=0)
+    tables = {}
+    con = sqlite3.connect(db_name)
+    con.execute("CREATE TABLE IF NOT EXISTS rates (currency TEXT, date TEXT, val REAL, nominal INTEGER, PRIMARY KEY (currency, date))")
+    con.execute("CREATE TABLE IF NOT EXISTS fetched (currency TEXT PRIMARY KEY, date_from TEXT, date_to TEXT)")
+    if names is None:
+        stored = [row[0] for row in con.execute("SELECT currency FROM fetched")]
+        names = [currency for currency in currencies if currency != "RUB"] + sorted(set(stored) - set(currencies))
+    stored = {}
+    starts = {}
+    for currency in names:
+        df, fetched = load_stored_rates(con, currency)
+        stored[currency] = (df, fetched)
+        if fetched is None or fetched[0] > From:
+            fetchFrom = From  # no data yet or StartDate moved back - fetch the whole history
+        else:
+            fetchFrom = fetched[1] + timedelta(days=1)
+        if fetchFrom <= To:
+            print(f"Получение таблицы курса {currency} с {fetchFrom.strftime('%d.%m.%Y')}...")
+            starts[currency] = fetchFrom
+        else:
+            print(f"Таблица курса {currency} загружена из {db_name}")
+    downloaded = download_tables(starts, To, source, jobs)
+    for currency in names:
+        df, fetched = stored[currency]
+        new_df = downloaded.get(currency)
+        if isinstance(new_df, OSError) and df.shape[0]:  # requests.RequestException is an OSError too
+            print(f"Не удалось обновить таблицу курса {currency} ({new_df}), используем сохраненную по {fetched[1].strftime('%d.%m.%Y')}")
+        elif isinstance(new_df, Exception):
+            raise new_df
+        elif new_df is not None:
+            store_rates(con, currency, new_df, min(fetched[0], From) if fetched else From, To)
+            df, _ = load_stored_rates(con, currency)
+        assert df.shape[0] > 0, f"Не удалось загрузить таблицу курсов {currency}!"
+        tables[currency] = df
+    con.close()
+    return CurrencyRates(tables)
@@ -0,0 +1,137 @@
+# coding: utf-8
+
+import numpy as np
+import pandas as pd
+
+from .lots import LotBook, match_lots, der_type, multiplier, book_multiplier, tradeColumns, lotFields
+from .calc import trade_amounts
+from .engine import YearResult
+from .instrument import stage, count
+
+# Суммы trades_calc, которые пересчитываются для сценария
+incomeNames = {
+    'income_rub_sum_cb': "Доход по ЦБ", 'income_rest_sum_cb': "Налог по ЦБ",
+    'income_rub_sum_pfi': "Доход по ПФИ", 'income_rest_sum_pfi': "Налог по ПФИ",
+}
+
+
+def income_kind(der):
+    """Доход по ЦБ (cb) или ПФИ (pfi), как в trades_calc"""
+    return "pfi" if der else "cb"
+
+
+def planned_trades(trades, multipliers=None):
+    """Планируемые сделки в виде раздела Trades из load_data, по дате.
+
+    trades - DataFrame или список словарей symbol, date, quantity (продажа < 0), price и необязательных
+    currency (USD), fee (комиссия, по умолчанию 0) и proceeds (по умолчанию -quantity * price * множитель контракта);
+    multipliers - {символ: множитель контракта, None - неизвестен}, для остальных символов - multiplier()
+    """
+    multipliers = multipliers or {}
+    df = pd.DataFrame(trades).copy()
+    if "currency" not in df:
+        df["currency"] = "USD"
+    if "fee" not in df:
+        df["fee"] = 0.0
+    assert (df.quantity != 0).all(), "Количество в сделке не может быть 0"
+    df["date"] = pd.to_datetime(df.date)
+    # fees are negative in the statement
+    df["fee"] = -df.fee.abs()
+    if "proceeds" not in df:
+        df["proceeds"] = np.nan
+    contracts = [multipliers[key] if key in multipliers else multiplier(key) for key in df.symbol]
+    default = df.proceeds.isna().to_numpy()
+    unknown = [key for key, contract, empty in zip(df.symbol, contracts, default) if empty and contract is None]
+    if unknown:
+        raise ValueError(f"Неизвестен множитель контракта {', '.join(dict.fromkeys(unknown))}, укажите proceeds")
+    df.loc[default, "proceeds"] = (-df.quantity * df.price * np.array(contracts, dtype=float))[default]
+    return df.sort_values("date", kind="stable").reset_index(drop=True)
+
+
+class Scenarios:
+    """Оценка планируемых сделок поверх результата TaxReportEngine.run() без повторного расчета.
+
+    Для сценария копируются только лоты затронутых тикеров, их продажи сопоставляются по FIFO заново,
+    а суммы года меняются на разницу по этим тикерам. Суммы по тикерам за год считаются один раз.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.rates = engine.load_rates()
+        self.assets = engine.assets
+        self.matched = engine.matched
+        # the last trade of the statements: sells and closed lots are in the matched rows, open lots in assets
+        dates = [rows.date.max() for rows in self.matched.values() if len(rows)]
+        dates += [lot.date for book in self.assets.values() for lot in book]
+        self.last_date = pd.Timestamp(max(dates)) if dates else None
+        # year -> (rows by ticker, amount_rub by ticker, amount_rub by income kind cb/pfi)
+        self.base = {}
+
+    def year_base(self, year):
+        if year not in self.base:
+            rows = self.matched.get(year)
+            if rows is None or not len(rows):
+                self.base[year] = ({}, {}, {})
+            else:
+                amounts = trade_amounts(rows, self.rates)
+                self.base[year] = (
+                    dict(tuple(rows.groupby("ticker", sort=False))),
+                    amounts.groupby("ticker").amount_rub.sum().to_dict(),
+                    amounts.groupby(amounts.der_type.map(income_kind)).amount_rub.sum().to_dict(),
+                )
+        return self.base[year]
+
+    def evaluate(self, trades):
+        """{год: YearResult} с суммами trades_calc по ЦБ и ПФИ с учетом сделок trades (см. planned_trades);
+        trades_res - строки сделок только затронутых тикеров"""
+        planned = planned_trades(trades, {key: book_multiplier(key, book) for key, book in self.assets.items()})
+        years = planned.date.dt.year
+        # a planned trade on the day of the last one comes after it: the time of day is usually not known
+        if self.last_date is not None and (planned.date.dt.normalize() < self.last_date.normalize()).any():
+            raise ValueError(f"Планируемые сделки должны быть не раньше последней сделки отчета {self.last_date:%Y-%m-%d}")
+        count("scenario_trades", len(planned))
+        missing = self.rates.missing(planned.currency)
+        if missing:
+            self.rates = self.engine.load_rates(currencies=missing)
+        books = {}
+        results = {}
+        for year, year_trades in planned.groupby(years):
+            by_ticker, ticker_sums, totals = self.year_base(year)
+            totals = dict(totals)
+            affected = []
+            for key, val in year_trades.groupby("symbol", sort=False):
+                if key not in books:
+                    books[key] = self.assets[key].copy() if key in self.assets else LotBook()
+                matched = match_lots(key, books[key], val)
+                rows = pd.DataFrame({
+                    'ticker': np.full(len(matched['cnt']), key, dtype=object),
+                    'der_type': np.full(len(matched['cnt']), der_type(key, books[key].category), dtype=object),
+                    **{name: np.asarray(matched[name]) for name in lotFields},
+                }, columns=tradeColumns)
+                if key in by_ticker:
+                    # the statement's asset category wins over the symbol guess
+                    rows["der_type"] = by_ticker[key].der_type.iloc[0]
+                    rows = pd.concat([by_ticker[key], rows], ignore_index=True)
+                amounts = trade_amounts(rows, self.rates)
+                kind = income_kind(rows.der_type.iloc[0]) if len(rows) else "cb"
+                totals[kind] = totals.get(kind, 0.0) + amounts.amount_rub.sum() - ticker_sums.get(key, 0.0)
+                affected.append(amounts)
+            res = YearResult(year)
+            for kind in ("cb", "pfi"):
+                res[f"income_rub_sum_{kind}"] = round(totals.get(kind, 0.0), 2)
+                res[f"income_rest_sum_{kind}"] = round(totals.get(kind, 0.0) * 0.13, 2)
+            res["trades_res"] = pd.concat(affected, ignore_index=True)
+            results[year] = res
+        return results
+
+
+def plan_report(engine, results, trades):
+    """Суммы по сделкам с учетом планируемых сделок рядом с суммами по отчету"""
+    with stage("scenario"):
+        scenario = Scenarios(engine).evaluate(trades)
+    for year, res in scenario.items():
+        base = results.get(year, {})
+        print(f"С планируемыми сделками за {year} год:")
+        for field, name in incomeNames.items():
+            print(f"{name}: {res[field]} Rub (по отчету {base.get(field) or 0} Rub)")
+    return scenario
@@ -0,0 +1,67 @@
+# coding: utf-8
+
+import os
+import json
+
+import pandas as pd
+
+# Форматы результатов кроме docx; имена файлов не зависят от языка, чтобы их было проще читать программами
+summaryName = "results.json"
+workbookName = "results.xlsx"
+
+
+def json_value(value):
+    return None if value is None else float(value)
+
+
+def write_json(results, outdir):
+    """Итоговые суммы по годам: {"2020": {"div_sum": ..., ...}}"""
+    fname = os.path.join(outdir, summaryName)
+    summary = {str(year): {name: json_value(value) for name, value in res.totals().items()} for year, res in sorted(results.items())}
+    with open(fname, "w", encoding="utf8") as file:
+        json.dump(summary, file, indent=2, ensure_ascii=False)
+    return [fname]
+
+
+def write_csv(results, outdir):
+    """Таблица на файл: {год}_{таблица}.csv"""
+    fnames = []
+    for year, res in sorted(results.items()):
+        for name, df in res.tables().items():
+            fname = os.path.join(outdir, f"{year}_{name}.csv")
+            df.to_csv(fname, index=False)
+            fnames.append(fname)
+    return fnames
+
+
+def write_xlsx(results, outdir):
+    """Одна книга: лист итогов (строка на год) и лист на каждую таблицу каждого года"""
+    fname = os.path.join(outdir, workbookName)
+    summary = pd.DataFrame.from_dict(
+        {year: {name: json_value(value) for name, value in res.totals().items()} for year, res in results.items()}, orient="index"
+    ).sort_index()
+    with pd.ExcelWriter(fname) as writer:
+        summary.to_excel(writer, sheet_name="totals", index_label="year")
+        for year, res in sorted(results.items()):
+            for name, df in res.tables().items():
+                df.to_excel(writer, sheet_name=f"{year} {name}", index=False)
+    return [fname]
+
+
+def write_parquet(results, outdir):
+    """Таблица на файл: {год}_{таблица}.parquet (нужен pyarrow или fastparquet)"""
+    fnames = []
+    for year, res in sorted(results.items()):
+        for name, df in res.tables().items():
+            fname = os.path.join(outdir, f"{year}_{name}.parquet")
+            df.to_parquet(fname, index=False)
+            fnames.append(fname)
+    return fnames
+
+
+sinks = {
+    "json": write_json,
+    "csv": write_csv,
+    "xlsx": write_xlsx,
+    "parquet": write_parquet,
+}
@@ -0,0 +1,335 @@
+# coding: utf-8
+
+import io
+import os
+import re
+import csv
+import mmap
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from .instrument import count
+
+reportDirName = "reports"
+# Папка для отладочного сохранения разделов отчетов
+dirname = "ibdata"
+
+sections = [
+    "Deposits & Withdrawals",
+    "Trades",
+    "Fees",
+    "Dividends",
+    "Withholding Tax",
+    "Change in Dividend Accruals",
+    "Interest",
+]
+
+
+# Отчет за год: YEAR.csv или любое имя, если год есть в поле Period раздела Statement
+reportName = re.compile(r"^(\d{4})\.csv$", re.IGNORECASE)
+periodPattern = re.compile(rb"^Statement,Data,Period,(.*)$", re.MULTILINE)
+# Строк начала отчета, в которых ищется Period
+headLines = 50
+
+
+def report_year(fname):
+    """Год отчета по имени YEAR.csv, иначе - последний год поля Period ("January 1, 2020 - December 31, 2020"), None - не отчет"""
+    match = reportName.match(os.path.basename(fname))
+    if match:
+        return int(match.group(1))
+    with open(fname, "rb") as file:
+        head = b"".join(file.readline() for _ in range(headLines))
+    period = periodPattern.search(head)
+    years = re.findall(rb"(?<!\d)\d{4}(?!\d)", period.group(1)) if period else []
+    return int(years[-1]) if years else None
+
+
+def find_reports(report_dir=reportDirName):
+    """[(год, путь)] по возрастанию года; файлы, год которых не определить, пропускаются"""
+    years = {}
+    # on case-insensitive file systems both patterns find the same files
+    for fname in sorted(set(glob(os.path.join(report_dir, "*.csv")) + glob(os.path.join(report_dir, "*.CSV")))):
+        year = report_year(fname)
+        if year is None:
+            print(f"--{fname}: не удалось определить год отчета, пропускаем")
+            continue
+        assert year not in years, f"Два отчета за {year} год: {years.get(year)} и {fname}"
+        years[year] = fname
+    return sorted(years.items())
+
+
+def preprocess_reports(report_dir=reportDirName):
+    print("Обработка отчетов по годам...")
+    yearReports = find_reports(report_dir)
+    for year, fname in yearReports:
+        print(f"--{fname}")
+    return yearReports
+
+
+# Столбцы разделов, которые используются в расчетах (имена в нижнем регистре), остальные не читаются
+sectionColumns = {
+    "Deposits & Withdrawals": ["header", "currency", "settle date", "amount"],
+    "Trades": [
+        "header", "datadiscriminator", "asset category", "currency", "symbol", "date/time", "quantity", "t. price", "proceeds",
+        "comm/fee", "comm in usd", "code"
+    ],
+    "Fees": ["header", "subtitle", "currency", "date", "amount"],
+    "Dividends": ["header", "currency", "date", "description", "amount"],
+    "Withholding Tax": ["header", "currency", "date", "description", "amount"],
+    "Change in Dividend Accruals": ["header", "currency", "symbol", "date", "tax", "gross amount"],
+    "Interest": ["header", "currency", "date", "description", "amount"],
+}
+# Повторяющиеся строковые значения
+categoryColumns = ["header", "datadiscriminator", "asset category", "currency", "symbol", "subtitle", "code"]
+# Код валюты ISO: строки итогов ("Total", "Total in USD") под него не подходят
+currencyPattern = r"[A-Z]{3}"
+# Строки Data раздела Trades, которые являются сделками; остальные (ClosedLot и др.) - подробности по лотам
+tradeDiscriminators = ["Order", "Trade"]
+# Коды IB для истечения, исполнения и назначения опционов: такие сделки идут без комиссии
+lifecycleCodes = r"(?:^|;)(?:Ep|Ex|A)(?:;|$)"
+# Единые имена столбцов разных заголовков одного раздела
+columnNames = {"comm/fee": "fee", "comm in usd": "fee", "date/time": "date", "t. price": "price", "settle date": "date"}
+# Форматы дат IB; если формат не подошел, дата разбирается как раньше, без формата
+dateFormats = {"Trades": "%Y-%m-%d, %H:%M:%S"}
+dateFormat = "%Y-%m-%d"
+# Строк раздела в одном фрагменте разбора
+chunkRows = 200000
+
+
+class ReportDialect(csv.excel):
+    """CSV отчета IB: поля в кавычках могут содержать запятые и переводы строк"""
+    strict = False
+
+
+class MappedRange(io.RawIOBase):
+    """Чтение диапазонов ranges [(начало, конец)] байт отчета без копирования их целиком"""
+
+    def __init__(self, buffer, ranges):
+        super().__init__()
+        self.buffer = buffer
+        self.ranges = list(ranges)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.ranges and self.ranges[0][0] >= self.ranges[0][1]:
+            self.ranges.pop(0)
+        if not self.ranges:
+            return 0
+        start, end = self.ranges[0]
+        size = min(len(b), end - start)
+        b[:size] = self.buffer[start:start + size]
+        self.ranges[0] = (start + size, end)
+        return size
+
+
+def header_offsets(buffer):
+    """[(раздел, начало строки заголовка)]: поиск ",Header," по байтам, раздел - первое поле той же строки;
+    заголовок Trades со столбцом Account пропускается"""
+    headers = []
+    pos = buffer.find(b",Header,")
+    while pos >= 0:
+        start = buffer.rfind(b"\n", 0, pos) + 1
+        name = buffer[start:pos]
+        if b"," not in name and b'"' not in name and not (name == b"Trades" and buffer[pos + 8:pos + 16] == b"Account,"):
+            headers.append((name.decode("utf8"), start))
+        pos = buffer.find(b",Header,", pos + 1)
+    return headers
+
+
+def skip_account_lines(buffer, start, end):
+    """Диапазоны раздела [start, end) без строк Trades, третье поле которых Account"""
+    ranges = []
+    first = start
+    pos = buffer.find(b",Account,", start, end)
+    while pos >= 0:
+        newline = buffer.rfind(b"\n", first, pos)
+        line = first if newline < 0 else newline + 1
+        if buffer[line:line + 7] == b"Trades," and buffer[line:pos].count(b",") == 1:
+            line_end = buffer.find(b"\n", pos, end)
+            ranges.append((start, line))
+            start = end if line_end < 0 else line_end + 1
+        pos = buffer.find(b",Account,", pos + 1, end)
+    ranges.append((start, end))
+    return [(a, b) for a, b in ranges if a < b]
+
+
+def read_section(buffer, ranges, section=None):
+    """Раздел из диапазонов ranges байт отчета, первая строка - заголовок; разбирается по chunkRows строк"""
+    start, end = ranges[0]
+    line_end = buffer.find(b"\n", start, end)
+    header = next(csv.reader([buffer[start:end if line_end < 0 else line_end].decode("utf8").rstrip("\r")], ReportDialect))
+    options = {}
+    if section in sectionColumns:
+        wanted = [name for name in header if name.lower() in sectionColumns[section]]
+        options = {"usecols": wanted, "dtype": {name: "category" for name in wanted if name.lower() in categoryColumns}}
+    with pd.read_csv(
+        io.BufferedReader(MappedRange(buffer, ranges)), encoding="utf8", dialect=ReportDialect, thousands=',',
+        chunksize=chunkRows, **options
+    ) as reader:
+        df = concat_fragments(list(reader))
+    if section in sectionColumns:
+        df.columns = [columnNames.get(col.lower(), col.lower()) for col in df]
+    return df
+
+
+def concat_fragments(frames):
+    """Один concat для повторных заголовков раздела; категории разных фрагментов объединяются"""
+    if len(frames) == 1:
+        return frames[0]
+    df = pd.concat(frames, ignore_index=True)
+    for col in df:
+        if col in categoryColumns and df[col].dtype != "category":
+            df[col] = df[col].astype("category")
+    return df
+
+
+def parse_dates(values, section=None):
+    try:
+        return pd.to_datetime(values, format=dateFormats.get(section, dateFormat))
+    except ValueError:
+        return pd.to_datetime(values)
+
+
+def dump_section(dump_dir, year, section, buffer, ranges):
+    out_fname = os.path.join(dump_dir, f"{year}_{section}.csv")
+    n = 1
+    while os.path.exists(out_fname):  # second header in the same section
+        out_fname = os.path.join(dump_dir, f"{year}_{section}{n}.csv")
+        n += 1
+    with open(out_fname, 'wb') as out_file:
+        for start, end in ranges:
+            out_file.write(buffer[start:end])
+    print(f"{out_fname} сгенерирован")
+
+
+def split_report(fileReport, dump_dir=None, names=None):
+    """Разделы отчета {раздел: [DataFrame, ...]}: файл отображается в память, заголовки разделов
+    ищутся по байтам, разбираются только разделы names (по умолчанию sections)"""
+    fname = f"{fileReport[1]}"
+    year = fileReport[0]
+    print(f"Разделение отчета {fname} на разделы...")
+
+    names = sections if names is None else names
+    data = {}
+    if os.path.getsize(fname) == 0:
+        return data
+    with open(fname, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        headers = header_offsets(buffer)
+        # a section lasts until the next header of any section
+        ends = [start for _, start in headers[1:]] + [len(buffer)]
+        for (section, start), end in zip(headers, ends):
+            if section not in names:
+                continue
+            ranges = skip_account_lines(buffer, start, end) if section == "Trades" else [(start, end)]
+            if dump_dir:
+                dump_section(dump_dir, year, section, buffer, ranges)
+            df = read_section(buffer, ranges, section)
+            count("rows_parsed", len(df))
+            data.setdefault(section, []).append(df)
+    return data
+
+
+def clear_dump_dir(dump_dir=dirname):
+    if not os.path.exists(dump_dir):
+        print(f"Создаем директорию {dump_dir}")
+        os.mkdir(dump_dir)
+    else:
+        print(f"Директория {dump_dir} уже существует")
+
+    files = glob(os.path.join(dump_dir, "*"))
+    for f in files:
+        print(f"Удаляем файл отчета {f}")
+        os.remove(f)
+
+
+def currency_rows(df):
+    """Строки с кодом валюты; различных значений мало, шаблон проверяется один раз для каждого"""
+    if isinstance(df.currency.dtype, pd.CategoricalDtype):
+        # code -1 (empty cell) takes the appended False
+        matched = np.array([re.fullmatch(currencyPattern, str(value)) is not None for value in df.currency.cat.categories] + [False])
+        return pd.Series(matched[df.currency.cat.codes.to_numpy()], index=df.index)
+    values = pd.Series(df.currency.dropna().unique(), dtype=object)
+    return df.currency.isin(values[values.str.fullmatch(currencyPattern)])
+
+
+def trade_rows(df):
+    """Маска строк сделок раздела Trades: Data с DataDiscriminator из tradeDiscriminators (если столбец есть)"""
+    rows = (df.header == "Data").to_numpy()
+    if "datadiscriminator" in df:
+        rows = rows & df.datadiscriminator.isin(tradeDiscriminators).to_numpy()
+    return rows
+
+
+def kept_trades(df):
+    """Маска сделок, которые берутся в расчет: с комиссией, а также истечение, исполнение и назначение опционов"""
+    if "code" in df:
+        # few distinct codes, match them once
+        codes = pd.Series(df.code.dropna().unique(), dtype=object)
+        lifecycle = df.code.isin(codes[codes.str.contains(lifecycleCodes)]).to_numpy()
+    else:
+        lifecycle = False
+    return trade_rows(df) & ((df.fee < 0).to_numpy() | lifecycle)
+
+
+def load_data(year, sections_data):
+    print(f"Чтение разделов отчета за {year} год...")
+    data = {}
+    for section, frames in sections_data.items():
+        print(f"--{section}")
+        data[section] = concat_fragments(frames)
+    if "Deposits & Withdrawals" in data:
+        cashflow = data["Deposits & Withdrawals"]
+        cashflow = cashflow[cashflow.header == "Data"]
+        cashflow = pd.DataFrame(cashflow[currency_rows(cashflow)])
+        cashflow.date = parse_dates(cashflow.date)
+    else:
+        cashflow = None
+    if "Trades" in data:
+        trades = data["Trades"]
+        trades = pd.DataFrame(trades[kept_trades(trades)])
+        trades.date = parse_dates(trades.date, "Trades")
+    else:
+        trades = None
+    if "Fees" in data:
+        comissions = data["Fees"]
+        comissions = comissions[comissions.header == "Data"]
+        comissions = pd.DataFrame(comissions[comissions.subtitle != "Total"])
+        comissions.date = parse_dates(comissions.date)
+        comissions = comissions[comissions.date.dt.year == year]
+    else:
+        comissions = None
+    if "Interest" in data:
+        interests = data["Interest"]
+        interests = interests[interests.header == "Data"]
+        interests = pd.DataFrame(interests[currency_rows(interests)])
+        interests.date = parse_dates(interests.date)
+        interests = interests[interests.date.dt.year == year]
+    else:
+        interests = None
+    if "Dividends" in data:
+        div = data["Dividends"]
+        div = pd.DataFrame(div[currency_rows(div)])
+        div.date = parse_dates(div.date)
+        div = pd.DataFrame(div[div.date.dt.year == year])
+    else:
+        div = None
+    if div is not None and "Withholding Tax" in data:
+        div_tax = data["Withholding Tax"]
+        div_tax = pd.DataFrame(div_tax[currency_rows(div_tax)])
+        div_tax.date = parse_dates(div_tax.date)
+        div_tax = pd.DataFrame(div_tax[div_tax.date.dt.year == year])
+    else:
+        div_tax = None
+    if "Change in Dividend Accruals" in data:
+        div_accurals = data["Change in Dividend Accruals"]
+        div_accurals = pd.DataFrame(div_accurals[currency_rows(div_accurals)])
+        div_accurals.date = parse_dates(div_accurals.date)
+        div_accurals = pd.DataFrame(div_accurals[div_accurals.date.dt.year == year])
+    else:
+        div_accurals = None
+    count("rows_loaded", sum(len(df) for df in (cashflow, trades, comissions, div, div_tax, div_accurals, interests) if df is not None))
+    return cashflow, trades, comissions, div, div_tax, div_accurals, interests
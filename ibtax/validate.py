@@ -0,0 +1,241 @@
+# coding: utf-8
+
+import numpy as np
+import pandas as pd
+
+from .statement import currency_rows, trade_rows
+from .calc import div_tax_unmatched
+from .instrument import count
+
+# Столбцы разделов (имена после columnNames), без которых расчет невозможен
+requiredColumns = {
+    "Deposits & Withdrawals": ["header", "currency", "date", "amount"],
+    "Trades": ["header", "currency", "symbol", "date", "quantity", "price", "proceeds", "fee"],
+    "Fees": ["header", "subtitle", "currency", "date", "amount"],
+    "Dividends": ["header", "currency", "date", "description", "amount"],
+    "Withholding Tax": ["header", "currency", "date", "description", "amount"],
+    "Change in Dividend Accruals": ["header", "currency", "symbol", "date", "tax", "gross amount"],
+    "Interest": ["header", "currency", "date", "description", "amount"],
+}
+numericColumns = ["amount", "quantity", "price", "proceeds", "fee", "tax", "gross amount"]
+# Разделы с итогом по каждой валюте: столбец, в котором у строки итога стоит Total
+totalColumns = {
+    "Deposits & Withdrawals": "currency",
+    "Fees": "subtitle",
+    "Dividends": "currency",
+    "Withholding Tax": "currency",
+    "Interest": "currency",
+}
+# Столбцы Trades, которые сверяются со строками Total по категории и валюте
+tradeTotals = ["proceeds", "fee"]
+# Допустимое расхождение с итогом отчета: итоги IB округлены до цента
+totalTolerance = 0.011
+# Курс старше стольких дней на дату операции считается устаревшим (новогодние праздники - до 11 дней)
+rateMaxAge = 15
+problemColumns = {
+    "year": int, "check": object, "section": object, "key": object, "expected": float, "actual": float, "rows": int, "detail": object,
+}
+checkNames = {
+    "schema": "нет столбца",
+    "values": "нечисловые значения",
+    "dropped": "сделки не вошли в расчет",
+    "totals": "сумма не сходится с итогом отчета",
+    "rates": "нет курса",
+    "div_tax": "удержанный налог без дивидендов",
+    "positions": "позиция не сходится со сделками",
+}
+
+
+def problems_frame(rows):
+    """Таблица проблем problemColumns из кортежей"""
+    columns = list(zip(*rows)) if rows else [()] * len(problemColumns)
+    return pd.DataFrame({name: np.array(values, dtype=dtype) for (name, dtype), values in zip(problemColumns.items(), columns)})
+
+
+def equals(values, value):
+    """Маска values == value; у category сравниваются коды"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        categories = values.cat.categories
+        if value not in categories:
+            return np.zeros(len(values), dtype=bool)
+        return values.cat.codes.to_numpy() == categories.get_loc(value)
+    return (values == value).to_numpy()
+
+
+def check_schema(year, sections):
+    """Нужные столбцы каждого фрагмента разделов и числовые значения в строках Data.
+
+    Эта и остальные проверки возвращают строки таблицы проблем (кортежи problemColumns), таблица строится один раз.
+    """
+    rows = []
+    for section, frames in sections.items():
+        for df in frames:
+            for col in requiredColumns.get(section, []):
+                if col not in df:
+                    rows.append((year, "schema", section, col, np.nan, np.nan, len(df), ""))
+            for col in numericColumns:
+                # columns that parsed as numbers need no check
+                if col not in df or df[col].dtype.kind in "fiub":
+                    continue
+                values = df[col][equals(df.header, "Data")] if "header" in df else df[col]
+                bad = (pd.to_numeric(values, errors="coerce").isna() & values.notna()).to_numpy()
+                if bad.any():
+                    rows.append((year, "values", section, col, np.nan, np.nan, int(bad.sum()), str(values[bad].iloc[0])))
+    return rows
+
+
+def check_sections(year, sections, trades):
+    """Проверки разобранного отчета: сделки, не вошедшие в расчет, и итоги разделов"""
+    count("validated_rows", sum(len(df) for frames in sections.values() for df in frames))
+    rows = check_dropped(year, sections.get("Trades", []), trades) + check_trade_totals(year, sections.get("Trades", []))
+    for section in totalColumns:
+        if section in sections:
+            rows += check_totals(year, section, sections[section])
+    return rows
+
+
+def check_dropped(year, frames, trades):
+    """Число сделок раздела Trades (trade_rows, без ClosedLot) по тикерам против сделок, взятых в расчет"""
+    data = [trade_rows(df) for df in frames]
+    # trades are a subset of the Data rows, equal counts mean nothing was dropped
+    if sum(mask.sum() for mask in data) == (len(trades) if trades is not None else 0):
+        return []
+    raw = [df.symbol[mask].value_counts() for df, mask in zip(frames, data)]
+    expected = pd.concat(raw).groupby(level=0).sum()
+    expected = expected[expected > 0]
+    used = trades.symbol.value_counts() if trades is not None else pd.Series(dtype=int)
+    used = used.groupby(level=0).sum().reindex(expected.index, fill_value=0)
+    diff = expected.index[(expected != used).to_numpy()]
+    return [(year, "dropped", "Trades", symbol, expected[symbol], used[symbol], expected[symbol] - used[symbol], "") for symbol in diff]
+
+
+def check_trade_totals(year, frames):
+    """Суммы сделок по категории и валюте против строк Total раздела Trades"""
+    rows = []
+    for df in frames:
+        if "asset category" not in df or not all(col in df for col in tradeTotals):
+            continue
+        totals = np.flatnonzero(equals(df.header, "Total"))
+        if not len(totals):
+            continue
+        data = trade_rows(df)
+        for pos in totals[currency_rows(df).to_numpy()[totals]]:
+            category, currency = df["asset category"].iat[pos], df.currency.iat[pos]
+            mask = data & equals(df["asset category"], category) & equals(df.currency, currency)
+            for col in tradeTotals:
+                expected = float(df[col].iat[pos])
+                actual = float(np.nansum(df[col].to_numpy(dtype=float)[mask]))
+                if abs(expected - actual) > totalTolerance:
+                    rows.append((year, "totals", "Trades", f"{category} {currency}", expected, actual, int(mask.sum()), col))
+    return rows
+
+
+def check_totals(year, section, frames):
+    """Суммы строк каждой валюты против строки Total, которая их закрывает"""
+    rows = []
+    for df in frames:
+        label = totalColumns[section]
+        if label not in df or "amount" not in df or df.amount.dtype.kind not in "fiu":
+            continue
+        is_total = equals(df[label], "Total")
+        if not is_total.any():
+            continue
+        data = equals(df.header, "Data") & currency_rows(df).to_numpy() & ~is_total
+        # a Total row closes the rows since the previous Total
+        block = np.cumsum(is_total) - is_total
+        amount = df.amount.to_numpy(dtype=float)
+        expected = amount[is_total]
+        actual = np.bincount(block[data], weights=amount[data], minlength=len(expected))[:len(expected)]
+        for n in np.flatnonzero(np.abs(expected - actual) > totalTolerance):
+            currencies = ",".join(map(str, pd.unique(df.currency.to_numpy()[data & (block == n)])))
+            rows.append((year, "totals", section, currencies, expected[n], actual[n], int((data & (block == n)).sum()), "amount"))
+    return rows
+
+
+def value_positions(values):
+    """{значение: позиции строк}; у category - по кодам, без группировки"""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        return {value: np.flatnonzero(codes == code) for code, value in enumerate(values.cat.categories)}
+    return values.groupby(values).indices
+
+
+def check_rates(year, data, rates):
+    """Курс на дату каждой операции: нет таблицы валюты, дата раньше первого курса или курс старше rateMaxAge дней"""
+    names = ["Deposits & Withdrawals", "Trades", "Fees", "Dividends", "Withholding Tax", "Change in Dividend Accruals", "Interest"]
+    rows = []
+    for name, df in zip(names, data):
+        if df is None or not len(df):
+            continue
+        dates = df.date.to_numpy(dtype="datetime64[ns]")
+        for cur, positions in value_positions(df.currency).items():
+            if cur == "RUB" or not len(positions):
+                continue
+            if cur not in rates.index:
+                rows.append((year, "rates", name, cur, np.nan, np.nan, len(positions), "нет таблицы курсов"))
+                continue
+            index_dates, _ = rates.index[cur]
+            pos = np.searchsorted(index_dates, dates[positions], side="right") - 1
+            bad = (pos < 0) | (dates[positions] - index_dates[np.maximum(pos, 0)] > np.timedelta64(rateMaxAge, "D"))
+            if bad.any():
+                first = pd.Timestamp(dates[positions][bad].min()).date()
+                detail = f"с {first}" if (pos[bad] < 0).all() else f"курс старше {rateMaxAge} дней, с {first}"
+                rows.append((year, "rates", name, cur, np.nan, np.nan, int(bad.sum()), detail))
+    return rows
+
+
+def check_div_tax(year, div, div_tax):
+    """Удержанный налог, которому не нашлось дивиденда с тем же тикером, датой и валютой: в расчете он не учитывается"""
+    if div_tax is None or not len(div_tax):
+        return []
+    return [
+        (year, "div_tax", "Withholding Tax", payment.key, payment.withheld, 0.0, 0, f"{payment.date:%Y-%m-%d} {payment.currency}")
+        for payment in div_tax_unmatched(div, div_tax).itertuples(index=False)
+    ]
+
+
+def lot_positions(assets):
+    """Количество открытых лотов по тикерам (короткие - со знаком минус)"""
+    return {key: sum(lot.quantity for lot in book) for key, book in assets.items()}
+
+
+def check_positions(year, before, after, trades):
+    """Позиции на начало года плюс количество сделок года против открытых лотов на конец года"""
+    expected = dict(before)
+    if trades is not None and len(trades):
+        if isinstance(trades.symbol.dtype, pd.CategoricalDtype):
+            codes = trades.symbol.cat.codes.to_numpy()
+            known = codes >= 0
+            quantity = np.bincount(
+                codes[known], weights=trades.quantity.to_numpy(dtype=float)[known], minlength=len(trades.symbol.cat.categories)
+            )
+            changes = zip(trades.symbol.cat.categories, quantity)
+        else:
+            changes = trades.quantity.groupby(trades.symbol).sum().items()
+        for symbol, quantity in changes:
+            expected[symbol] = expected.get(symbol, 0) + quantity
+    return [
+        (year, "positions", "Trades", symbol, expected.get(symbol, 0), after.get(symbol, 0), 0, "")
+        for symbol in sorted(expected.keys() | after.keys()) if abs(expected.get(symbol, 0) - after.get(symbol, 0)) > 1e-6
+    ]
+
+
+def amount(value):
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def print_problems(year, problems):
+    if problems is None or not len(problems):
+        print(f"Проверка отчета за {year} год: проблем не найдено")
+        return
+    print(f"Проверка отчета за {year} год: найдено проблем - {len(problems)}")
+    for problem in problems.itertuples(index=False):
+        values = "" if np.isnan(problem.expected) else f", в отчете {amount(problem.expected)}, в расчете {amount(problem.actual)}"
+        detail = f" ({problem.detail})" if problem.detail else ""
+        rows = f", строк {problem.rows}" if problem.rows else ""
+        print(f"--{problem.section}: {checkNames[problem.check]} {problem.key}{detail}{values}{rows}")
+
+
+def print_report(results):
+    for year in sorted(results):
+        print_problems(year, results[year].get("validation_res"))
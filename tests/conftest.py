@@ -0,0 +1,43 @@
+# coding: utf-8
+
+import os
+import sys
+import json
+import argparse
+import contextlib
+from datetime import datetime
+
+import pytest
+
+testsDir = os.path.dirname(os.path.abspath(__file__))
+benchDir = os.path.join(testsDir, "..", "benchmarks")
+digestsName = os.path.join(testsDir, "data", "digests.json")
+sys.path.insert(0, benchDir)
+import generate  # noqa: E402
+import run  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def digests():
+    """Сохраненные дайджесты расчетов и документов и параметры benchmarks/generate.py, по которым они получены"""
+    with open(digestsName, encoding="utf8") as file:
+        return json.load(file)
+
+
+@pytest.fixture(scope="session")
+def statement(tmp_path_factory, digests):
+    """Синтетический отчет и результаты run.run_pipeline() по нему: (каталог, годы, источник курсов, results)"""
+    parser = argparse.ArgumentParser()
+    generate.add_arguments(parser)
+    args = parser.parse_args(digests["params"])
+    workdir = str(tmp_path_factory.mktemp("statement"))
+    generate.generate_statements(workdir, args)
+    source = generate.write_rates(workdir, datetime(min(args.years) - 1, 12, 1), datetime(max(args.years), 12, 31), seed=args.seed)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            results, _ = run.run_pipeline(workdir, source, args.years, run.Stages(memory=False))
+    finally:
+        os.chdir(cwd)
+    return workdir, args.years, source, results
@@ -0,0 +1,31 @@
+# coding: utf-8
+
+import os
+import zipfile
+import contextlib
+
+import pytest
+
+from ibtax import doc
+from ibtax.doc import create_doc, ReportTemplate
+
+
+def parts(fname):
+    with zipfile.ZipFile(fname) as docx:
+        return {name: docx.read(name) for name in docx.namelist()}
+
+
+@pytest.mark.parametrize("rows_min", [1, doc.fastRowsMin])
+def test_fast_document_equals_docxtpl(statement, tmp_path, monkeypatch, rows_min):
+    workdir, years, _, results = statement
+    # rows_min = 1 writes every table directly, the default keeps short tables in jinja
+    monkeypatch.setattr(doc, "fastRowsMin", rows_min)
+    (tmp_path / "fast").mkdir()
+    (tmp_path / "stock").mkdir()
+    for year in years:
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            fast = create_doc(year, results[year], f"01.12.{min(years) - 1}", outdir=str(tmp_path / "fast"))
+            with monkeypatch.context() as m:
+                m.setattr(ReportTemplate, "save", ReportTemplate.save_docxtpl)
+                stock = create_doc(year, results[year], f"01.12.{min(years) - 1}", outdir=str(tmp_path / "stock"))
+        assert parts(fast) == parts(stock)
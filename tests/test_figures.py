@@ -0,0 +1,18 @@
+# coding: utf-8
+
+import os
+
+import run
+
+
+def test_figures_match_stored_digests(statement, digests):
+    """Цифры и документы по отчету из tests/data/digests.json, как в benchmarks/run.py --compare"""
+    workdir, years, _, results = statement
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        documents = run.documents_digest(years)
+    finally:
+        os.chdir(cwd)
+    assert {str(year): digest for year, digest in run.figures_digest(results).items()} == digests["figures"]
+    assert {str(year): digest for year, digest in documents.items()} == digests["documents"]
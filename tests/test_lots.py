@@ -0,0 +1,72 @@
+# coding: utf-8
+
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ibtax import lots as lots_module
+from ibtax.lots import LotBook, Lot, match_lots, match_lots_loop, lotFields
+
+
+def random_trades(rng, size, position=0):
+    """Сделки одного тикера: покупки и продажи не больше открытой позиции, как у match_lots без перехода в цикл"""
+    quantity = []
+    for _ in range(size):
+        if position > 0 and rng.random() < 0.45:
+            sell = -int(rng.integers(1, position + 1))
+        else:
+            sell = int(rng.integers(1, 500))
+        quantity.append(sell)
+        position += sell
+    quantity = np.array(quantity)
+    price = rng.uniform(1, 300, size).round(2)
+    return pd.DataFrame({
+        "date": pd.date_range("2020-01-01", periods=size, freq="h"),
+        "price": price,
+        "fee": -rng.uniform(0.35, 5, size).round(2),
+        "quantity": quantity,
+        "currency": "USD",
+        "proceeds": (-quantity * price).round(2),
+    })
+
+
+def open_book(rng, lots):
+    book = LotBook("Stocks")
+    for n in range(lots):
+        quantity = int(rng.integers(1, 300))
+        price = round(float(rng.uniform(1, 300)), 2)
+        book.add(Lot(pd.Timestamp("2019-06-01") + pd.Timedelta(days=n), price, -1.0, quantity, "USD", -quantity * price))
+    return book
+
+
+def book_state(book):
+    return [(pd.Timestamp(lot.date), lot.price, lot.fee, lot.quantity, lot.currency, lot.proceeds) for lot in book]
+
+
+def matched_frame(matched):
+    df = pd.DataFrame({name: np.asarray(matched[name]) for name in lotFields})
+    df["date"] = pd.to_datetime(df.date)
+    return df
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_match_lots_equals_loop(seed, monkeypatch):
+    rng = np.random.default_rng(seed)
+    lots = int(rng.integers(0, 5))
+    fast_book, loop_book = open_book(np.random.default_rng(seed), lots), open_book(np.random.default_rng(seed), lots)
+    position = sum(lot.quantity for lot in fast_book)
+    # two years: the second one starts from the lots left by the first
+    for size in (int(rng.integers(1, 200)), int(rng.integers(1, 200))):
+        trades = random_trades(rng, size, position)
+        position += int(trades.quantity.sum())
+        with contextlib.redirect_stdout(io.StringIO()):
+            # the vectorised path must not fall back to the loop on these trades
+            with monkeypatch.context() as m:
+                m.setattr(lots_module, "match_lots_loop", None)
+                fast = match_lots("SYM", fast_book, trades)
+            loop = match_lots_loop("SYM", loop_book, trades)
+        pd.testing.assert_frame_equal(matched_frame(fast), matched_frame(loop), check_dtype=False)
+        assert book_state(fast_book) == book_state(loop_book)